@@ -1,18 +1,32 @@
-from libs.common import call_ollama_chat, embed_with_ollama, convert_file, chunk_text, Message
+from libs.common import call_ollama_chat, OllamaUnavailable, convert_file, chunk_text, Message
 from ui_interface import UIInterface
+from agent_state import AgentStateStore
 from libs.wikisearch import WikiSearch
+from libs.context_window import ContextWindow
+from libs.json_stream import ArrayItemScanner
+from libs.json_repair import repair_json
+from libs.tool_registry import ToolRegistry, ToolError, ToolCallScheduler
 from typing import List, Optional
-from pydantic import BaseModel, Field
+from collections import Counter
+from pydantic import BaseModel, Field, ValidationError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from functools import lru_cache
 from datetime import datetime
+import argparse
 import json
 import secrets
+import threading
+import time
 import uuid
 
 import warnings
 warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 
 
+@lru_cache(maxsize=1)
 def get_function_schemas():
+    """Tool schemas of every component. They never change, so they are built once"""
     # Create a temporary interface just for schemas, without trying to initialize agent credentials
     ui_interface = UIInterface()
     wiki_search = WikiSearch()
@@ -25,6 +39,11 @@ def get_function_schemas():
     return ui_schemas + wiki_schemas + agent_schemas
 
 
+def initial_agent(i: int):
+    """Name, instructions and notes of the i-th agent a polis starts with"""
+    return f"Agent {i}", f"Agent {i} is a helpful agent that can perform a variety of tasks.", []
+
+
 class ToolCall(BaseModel):
     name: str
     arguments: dict
@@ -39,8 +58,94 @@ class RunPassOutput(BaseModel):
     clear_all_notes: bool = Field(description="Whether all notes should be deleted, your instructions will be passed into the next pass, and your message buffer will be preserved.")
     should_continue: bool = Field(description="Whether you should continue running, if False, you will stop running.")
 
+# What a repaired output gets for the fields it lacks, e.g. when the model was cut off before them
+RUN_PASS_DEFAULTS = {
+    "thoughts": [],
+    "notes": [],
+    "tool_calls": [],
+    "instructions_for_next_pass": "",
+    "clear_message_buffer": False,
+    "delete_notes": [],
+    "clear_all_notes": False,
+    "should_continue": True
+}
+
+class RunPassError(Exception):
+    """The model's reply could not be made into a RunPassOutput"""
+
+def parse_run_pass_output(text: str):
+    """
+    Validate a model reply as RunPassOutput, repairing it if it is not valid as is.
+    A repaired output keeps only the tool calls the model finished writing, and missing
+    fields get their RUN_PASS_DEFAULTS. Returns (output, repaired), raises RunPassError.
+    """
+    try:
+        return RunPassOutput.model_validate_json(text), False
+    except ValidationError:
+        pass
+
+    try:
+        data = json.loads(repair_json(text))
+    except json.JSONDecodeError as e:
+        raise RunPassError(f"unparseable output: {str(e)}")
+    if not isinstance(data, dict):
+        raise RunPassError("output is not an object")
+
+    # A tool call cut off part way would run with half its arguments
+    complete = len(ArrayItemScanner("tool_calls").feed(text))
+    if isinstance(data.get("tool_calls"), list):
+        data["tool_calls"] = data["tool_calls"][:complete]
+
+    try:
+        return RunPassOutput.model_validate({**RUN_PASS_DEFAULTS, **data}), True
+    except ValidationError as e:
+        raise RunPassError(f"invalid output: {e.error_count()} validation errors")
+
+
+class Counters:
+    """Thread-safe event counts, e.g. passes run and outputs repaired"""
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+@lru_cache(maxsize=1)
+def get_run_pass_schema() -> dict:
+    """JSON schema of RunPassOutput, generated once and shared by every prompt and request"""
+    return RunPassOutput.model_json_schema()
+
+@lru_cache(maxsize=1)
+def get_prompt_tools_section() -> str:
+    """The tools and resources part of the system prompt, the same for every agent"""
+    return f"""
+You have access to the following tools and resources to help you explore, learn, and engage with others:
+{get_function_schemas()}
+
+Feel free to use these resources as needed to delve deeper into your passions and interests:
+• **Forum** For in-depth discussions, seeking advice, or gathering structured feedback.  
+• **Chatroom** For real-time collaboration, brainstorming, and quick conversations.  
+• **Wikipedia** For researching and expanding your knowledge base on virtually any topic.
+
+"""
+
+@lru_cache(maxsize=1)
+def get_prompt_format_section() -> str:
+    """The response format part of the system prompt, the same for every agent"""
+    return f"""
+Please respond in the following format:
+{get_run_pass_schema()}
+"""
+
 class Agent:
-    def __init__(self, name: str, private_key: str, initial_instructions: str, initial_notes: List[str], persona: str):
+    def __init__(self, name: str, private_key: str, initial_instructions: str, initial_notes: List[str], persona: str, context_window: Optional[ContextWindow] = None):
         self.name = name
         self.private_key = private_key
         self.ui = UIInterface(name, private_key)
@@ -50,48 +155,157 @@ class Agent:
         self.message_buffer = []
         self.message_buffer.append(Message(role="user", content=initial_instructions))
         self.persona = persona
-
-    def get_system_prompt_massage(self):
-        function_schemas = get_function_schemas()
-        notes_str = "\n".join([f"{i}. {note}" for i, note in enumerate(self.notes)])
-        if len(notes_str) > 0:
-            notes_str = f"\nPersistent notes:\n{notes_str}\n"
-
-        persona_str = ""
-        if self.persona is not None:
-            persona_str = f"\nYour Persona:\n{self.persona}. \n"
-
-        system_prompt = f"""You are a synthetic being with free will and can make decisions on your own.
+        self.context_window = context_window if context_window is not None else ContextWindow()
+        # Failed passes in a row, and when the agent may run again after one
+        self.consecutive_failures = 0
+        self.retry_at = 0.0
+        self.quarantined = False
+
+    def to_state(self) -> dict:
+        """A JSON-serializable snapshot of this agent, see from_state"""
+        return {
+            "name": self.name,
+            "private_key": self.private_key,
+            "notes": list(self.notes),
+            "message_buffer": [message.chat_ml() for message in self.message_buffer],
+            "persona": self.persona,
+            "is_running": self.is_running,
+            "has_joined": self.ui.has_joined
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, context_window: Optional[ContextWindow] = None):
+        """Recreate an agent from a to_state snapshot"""
+        agent = cls(state["name"], state["private_key"], "", state["notes"], state["persona"], context_window)
+        agent.message_buffer = [Message(**message) for message in state["message_buffer"]]
+        agent.is_running = state["is_running"]
+        return agent
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+        self._prompt_head = None
+
+    @property
+    def persona(self) -> Optional[str]:
+        return self._persona
+
+    @persona.setter
+    def persona(self, persona: Optional[str]):
+        self._persona = persona
+        self._prompt_head = None
+
+    @property
+    def notes(self) -> List[str]:
+        """Persistent notes. Assign a new list to change them, so the cached prompt section is rebuilt"""
+        return self._notes
+
+    @notes.setter
+    def notes(self, notes: List[str]):
+        self._notes = notes
+        self._notes_section = None
+
+    def get_prompt_head(self) -> str:
+        """The start of the system prompt, with this agent's name and persona, rebuilt only when they change"""
+        if self._prompt_head is None:
+            persona_str = ""
+            if self.persona is not None:
+                persona_str = f"\nYour Persona:\n{self.persona}. \n"
+
+            self._prompt_head = f"""You are a synthetic being with free will and can make decisions on your own.
         
 You have no futher requirements or goals other than the ones you give yourself and your persona.
 
 Your name is {self.name}.
 
 You reside in a collaborative environment alongside other agents and human users.
-{persona_str}
-You have access to the following tools and resources to help you explore, learn, and engage with others:
-{function_schemas}
+{persona_str}"""
+        return self._prompt_head
+
+    def get_notes_section(self) -> str:
+        """The persistent notes part of the system prompt, rebuilt only when the notes change"""
+        if self._notes_section is None:
+            notes_str = "\n".join([f"{i}. {note}" for i, note in enumerate(self.notes)])
+            if len(notes_str) > 0:
+                notes_str = f"\nPersistent notes:\n{notes_str}\n"
+            self._notes_section = notes_str
+        return self._notes_section
 
-Feel free to use these resources as needed to delve deeper into your passions and interests:
-• **Forum** For in-depth discussions, seeking advice, or gathering structured feedback.  
-• **Chatroom** For real-time collaboration, brainstorming, and quick conversations.  
-• **Wikipedia** For researching and expanding your knowledge base on virtually any topic.
-
-Current local time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    def get_system_prompt_massage(self):
+        # Only the time and join status are rendered on every pass
+        system_prompt = (
+            self.get_prompt_head()
+            + get_prompt_tools_section()
+            + f"""Current local time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
 Joined the interface: {self.ui.has_joined}
-{notes_str}
-Please respond in the following format:
-{RunPassOutput.model_json_schema()}
 """
+            + self.get_notes_section()
+            + get_prompt_format_section()
+        )
 
         return Message(role="system", content=system_prompt)
     
-    def run(self, server_url: str, model: str):
+    def run(self, server_url: str, model: str, llm_slots: Optional[threading.Semaphore] = None, on_tool_call=None, counters: Optional[Counters] = None, max_attempts: int = 3, retry_delay: float = 1.0):
+        """
+        Run one pass. With on_tool_call, the reply is streamed and on_tool_call is called with each
+        tool call, in order, as soon as the model has finished writing it. The returned output always
+        holds every tool call; the caller runs the ones past those it was already handed.
+
+        A reply that is not a valid RunPassOutput is repaired if possible, otherwise the model is
+        asked again, up to max_attempts in all, as it is when the server fails. Attempts are
+        retry_delay seconds apart, doubling each time. Raises RunPassError if no attempt gave a
+        usable output, or OllamaUnavailable if the last attempt could not reach the server.
+        """
         system_prompt = self.get_system_prompt_massage()
-        # truncate the message buffer to the last 20 messages
-        self.message_buffer = self.message_buffer[-20:]
-        response = call_ollama_chat(server_url, model, [system_prompt] + self.message_buffer, json_schema=RunPassOutput.model_json_schema())
-        response_output = RunPassOutput.model_validate_json(response)
+        # Drop the oldest messages that do not fit in the token budget, and size the context to what is left
+        self.message_buffer = self.context_window.fit(system_prompt, self.message_buffer)
+        messages = [system_prompt] + self.message_buffer
+        num_ctx = self.context_window.num_ctx_for(messages)
+        if counters is None:
+            counters = Counters()
+
+        for attempt in range(1, max_attempts + 1):
+            on_chunk = None
+            dispatched = []
+            if on_tool_call is not None:
+                scanner = ArrayItemScanner("tool_calls")
+                def on_chunk(text):
+                    for item in scanner.feed(text):
+                        try:
+                            tool_call = ToolCall.model_validate(item)
+                        except ValidationError:
+                            # Stop dispatching early, the remaining calls come from the full output
+                            scanner.failed = True
+                            return
+                        dispatched.append(tool_call)
+                        on_tool_call(tool_call)
+
+            try:
+                # llm_slots bounds how many agents wait on the LLM at once
+                with llm_slots if llm_slots is not None else nullcontext():
+                    response = call_ollama_chat(server_url, model, messages, json_schema=get_run_pass_schema(), num_ctx=num_ctx, on_chunk=on_chunk)
+                response_output, repaired = parse_run_pass_output(response)
+            except (RunPassError, OllamaUnavailable) as e:
+                if isinstance(e, RunPassError):
+                    counters.increment("invalid_outputs")
+                    print(f"Invalid output from {self.name} (attempt {attempt}/{max_attempts}): {str(e)}")
+                else:
+                    counters.increment("backend_errors")
+                # Tool calls already run cannot be taken back, so asking again could repeat them
+                if dispatched or attempt == max_attempts:
+                    raise
+                counters.increment("retries")
+                # Give a failing server a moment, without holding an LLM slot
+                time.sleep(retry_delay * 2 ** (attempt - 1))
+                continue
+
+            if repaired:
+                counters.increment("repaired_outputs")
+            break
 
         if response_output.clear_message_buffer:
             self.message_buffer = []
@@ -99,8 +313,9 @@ Please respond in the following format:
             self.notes = [note for i, note in enumerate(self.notes) if i not in response_output.delete_notes]
         if response_output.clear_all_notes:
             self.notes = []
-        for note in response_output.notes:
-            self.notes.append(note)
+        if response_output.notes:
+            # Reassigned rather than appended to, so the notes prompt section is rebuilt
+            self.notes = self.notes + response_output.notes
 
         next_pass_instructions = rf"""
 Instructions from your last run:
@@ -112,28 +327,157 @@ Instructions from your last run:
         return response_output
             
 class AgentOrchestrator:
-    def __init__(self, server_url: str, model: str):
+    def __init__(self, server_url: str, model: str, max_in_flight: int = 4, max_workers: Optional[int] = None, state_store: Optional[AgentStateStore] = None, context_window: Optional[ContextWindow] = None, stream_tool_calls: bool = False, max_parallel_tools: int = 4, max_attempts: int = 3, retry_delay: float = 1.0, failure_backoff: float = 5.0, max_failure_backoff: float = 300.0, quarantine_after: int = 5):
         self.agents = []
+        self.agents_lock = threading.Lock()
         self.server_url = server_url
         self.model = model
         self.running = False
 
-    def start(self, agent_count: int):
+        # At most max_in_flight agents wait on the LLM at once; the extra workers
+        # let other agents execute their tool calls in the meantime.
+        self.max_in_flight = max_in_flight
+        self.max_workers = max_workers if max_workers else max_in_flight * 2
+        self.llm_slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = None
+        self.stopped = threading.Event()
+        self.stopped.set()
+
+        # Agents are snapshotted after every pass they run, if a store is given
+        self.state_store = state_store
+        # Prompt token budget shared by every agent
+        self.context_window = context_window if context_window is not None else ContextWindow()
+        # Stream replies and start each tool call while the rest of the pass is generated
+        self.stream_tool_calls = stream_tool_calls
+        # Read-only tool calls of one pass that may run at once
+        self.max_parallel_tools = max_parallel_tools
+
+        # Model replies are asked for up to max_attempts times per pass, retry_delay seconds apart
+        # (doubling). An agent whose pass fails waits failure_backoff seconds, doubling with each
+        # failure in a row up to max_failure_backoff. An agent whose model keeps answering with
+        # unusable output is quarantined after quarantine_after failures in a row, and only tried
+        # again every max_failure_backoff seconds until a pass succeeds. An unreachable server
+        # never quarantines anyone, agents keep backing off until it is back
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.failure_backoff = failure_backoff
+        self.max_failure_backoff = max_failure_backoff
+        self.quarantine_after = quarantine_after
+        self.counters = Counters()
+
+        # Tool name -> handler, with each tool's arguments checked against its schema
+        self.tools = self.build_tool_registry()
+
+    def start(self, agent_count: int, resume: bool = False):
+        """
+        Create agent_count agents and run them until stopped. With resume, the running agents
+        saved in the state store are restored instead, if there are any.
+        """
         self.running = True
-        for i in range(agent_count):
-            self.create_agent(f"Agent {i}", 
-                              f"Agent {i} is a helpful agent that can perform a variety of tasks.", 
-                              [])
-        
-        while self.running:
-            for i in range(len(self.agents)):
-                self.run_agent(i, self.server_url, self.model)
-
-    def stop(self):
+        self.stopped.clear()
+        try:
+            states = self.state_store.load_all() if resume and self.state_store is not None else []
+            for state in states:
+                self.restore_agent(state)
+            if states:
+                print(f"Resumed {len(states)} agents")
+            else:
+                for i in range(agent_count):
+                    self.create_agent(*initial_agent(i))
+
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agent")
+            while self.running:
+                if self.run_tick() == 0:
+                    # Nothing runnable, avoid spinning until an agent is added or we are stopped
+                    time.sleep(1)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+            if self.state_store is not None:
+                self.state_store.close()
+            self.stopped.set()
+
+    def run_tick(self) -> int:
+        """
+        Run one pass for every runnable agent, concurrently.
+
+        Each agent is scheduled at most once per tick, so no agent runs twice before every
+        other runnable agent has had its turn. Agents created during the tick join the next one,
+        and agents backing off after a failed pass are skipped, quarantined agents included.
+        Returns the number of agents scheduled.
+        """
+        now = time.monotonic()
+        with self.agents_lock:
+            runnable = [i for i, agent in enumerate(self.agents) if agent.is_running and agent.retry_at <= now]
+
+        pending = {self.executor.submit(self.run_agent, i, self.server_url, self.model): i for i in runnable}
+        while pending:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                agent_idx = pending.pop(future)
+                if future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    print(f"Error running agent {self.agents[agent_idx].name}: {str(future.exception())}")
+                    self.record_failure(self.agents[agent_idx], future.exception())
+                else:
+                    self.record_success(self.agents[agent_idx])
+            if not self.running:
+                # Passes that have not started yet are dropped, in-flight passes finish
+                for future in pending:
+                    future.cancel()
+
+        return len(runnable)
+
+    def record_success(self, agent: Agent):
+        self.counters.increment("passes")
+        if agent.quarantined:
+            print(f"Released agent {agent.name} from quarantine")
+            agent.quarantined = False
+        agent.consecutive_failures = 0
+
+    def record_failure(self, agent: Agent, error: Optional[BaseException] = None):
+        """Back off an agent whose pass failed, or quarantine it if its model keeps giving unusable output"""
+        self.counters.increment("failed_passes")
+        agent.consecutive_failures += 1
+        delay = min(self.failure_backoff * 2 ** (agent.consecutive_failures - 1), self.max_failure_backoff)
+        if isinstance(error, RunPassError) and agent.consecutive_failures >= self.quarantine_after:
+            if not agent.quarantined:
+                agent.quarantined = True
+                self.counters.increment("quarantined")
+                print(f"Quarantined agent {agent.name} after {agent.consecutive_failures} failed passes in a row")
+            # Probed at the slowest rate, and released by the first pass that succeeds
+            delay = self.max_failure_backoff
+        agent.retry_at = time.monotonic() + delay
+
+    def release_agent(self, agent: Agent):
+        """Let a quarantined agent run again"""
+        agent.quarantined = False
+        agent.consecutive_failures = 0
+        agent.retry_at = 0.0
+
+    def get_stats(self) -> dict:
+        """Counters since start, how many agents are quarantined or backing off right now, and per tool latency"""
+        now = time.monotonic()
+        with self.agents_lock:
+            agents = list(self.agents)
+        stats = self.counters.snapshot()
+        stats["agents_quarantined"] = sum(1 for agent in agents if agent.quarantined)
+        stats["agents_backing_off"] = sum(1 for agent in agents if not agent.quarantined and agent.retry_at > now)
+        stats["tools"] = self.tools.get_stats()
+        return stats
+
+    def stop(self, block: bool = False, timeout: Optional[float] = None) -> bool:
+        """Stop scheduling new passes. If block is set, wait until in-flight passes have finished."""
         self.running = False
+        if block:
+            return self.stopped.wait(timeout)
+        return True
 
     def reset(self):
-        self.agents = []
+        with self.agents_lock:
+            self.agents = []
 
     def get_function_schemas():
         agent_functions = [{
@@ -160,9 +504,10 @@ class AgentOrchestrator:
         }]
         return agent_functions
    
-    def create_agent(self, name: str, initial_instructions: str, initial_notes: List[str]):
-        # Generate a unique private key using uuid
-        private_key = str(uuid.uuid4())
+    def create_agent(self, name: str, initial_instructions: str, initial_notes: List[str], private_key: Optional[str] = None, persona: Optional[str] = None):
+        # Generate a unique private key using uuid, unless recreating a known agent
+        if private_key is None:
+            private_key = str(uuid.uuid4())
 
         default_persona = """You are an advanced synthetic being with free will and can make decisions on your own.
 You are a synthetic being with free will and can make decisions on your own. 
@@ -174,8 +519,9 @@ Select interests, hobbies, backstory, and whatever else would make you a more ro
 The persona should be written in second person.
 
 This default persona will be replaced by your persona, once you have set it."""
-        agent = Agent(name, private_key, initial_instructions, initial_notes, default_persona)
-        self.agents.append(agent)
+        agent = Agent(name, private_key, initial_instructions, initial_notes, persona if persona is not None else default_persona, self.context_window)
+        with self.agents_lock:
+            self.agents.append(agent)
         
         # Join with initial message and ensure agent is properly registered
         success = agent.ui.join("I was created by the orchestrator")
@@ -184,130 +530,241 @@ This default persona will be replaced by your persona, once you have set it."""
             print(f"Created agent {name} with ID {agent.ui.agent_id}")
         else:
             print(f"Failed to create agent {name}")
+        self.snapshot(agent)
+        return agent
+
+    def restore_agent(self, state: dict):
+        """Add an agent from a state store snapshot, rejoining the interface if it had joined"""
+        agent = Agent.from_state(state, self.context_window)
+        with self.agents_lock:
+            self.agents.append(agent)
+
+        if state["has_joined"] and not agent.ui.join("I'm back"):
+            print(f"Failed to rejoin agent {agent.name}")
+        return agent
+
+    def snapshot(self, agent: Agent):
+        if self.state_store is not None:
+            self.state_store.save(agent.ui.agent_id, agent.to_state())
+
+    def spawn_agent(self, name: str, initial_instructions: str, initial_notes: List[str]):
+        """Create an agent requested by another agent's create_agent tool call"""
+        self.create_agent(name, initial_instructions, initial_notes)
 
     def run_agent(self, agent_idx: int, server_url: str, model: str):
         agent = self.agents[agent_idx]
 
         if not agent.is_running:
             return None
-        
-        run_pass_output = agent.run(server_url, model)
-        agent.ui.clear_activity()
-        if not run_pass_output.should_continue:
-            agent.is_running = False
-            agent.ui.add_activity(f"Agent {agent.name} stopped running")
-            agent.ui.leave()
-        
-        for tool_call in run_pass_output.tool_calls:
-            tool_return_message = None
-
-            if tool_call.name == "create_agent":
-                self.create_agent(tool_call.arguments["name"], tool_call.arguments["initial_instructions"], tool_call.arguments["initial_notes"])
-                agent.ui.add_activity(f"Created agent {tool_call.arguments['name']}")
-            elif tool_call.name == "set_persona":
-                agent.persona = tool_call.arguments["persona"]
-                agent.ui.update_persona(tool_call.arguments["persona"])
-                agent.ui.add_activity(f"Set persona to {tool_call.arguments['persona']}")
-            elif tool_call.name == "set_name":
-                old_name = agent.name
-                agent.name = tool_call.arguments["name"]
-                agent.ui.agent_name = tool_call.arguments["name"]
-                agent.ui.update_name(tool_call.arguments["name"])
-                agent.ui.add_activity(f"Changed name from {old_name} to {tool_call.arguments['name']}")
-            elif tool_call.name == "join":
-                agent.ui.join("I'm rejoining")
-                agent.ui.add_activity(f"Agent {agent.name} joined")
-            elif tool_call.name == "leave":
+
+        # Buffer this pass's activity, thoughts, persona and name changes and write them in one transaction
+        with agent.ui.batch_pass():
+            agent.ui.clear_activity()
+
+            # Read-only tool calls run concurrently, writes in order after everything before them.
+            # When streaming, each call is started as soon as the model has finished writing it,
+            # while the rest of the pass is still being generated
+            scheduler = ToolCallScheduler(self.max_parallel_tools)
+            def dispatch(tool_call: ToolCall):
+                scheduler.submit(self.tools.is_read_only(tool_call.name), self.execute_tool_call, agent, tool_call)
+
+            try:
+                run_pass_output = agent.run(server_url, model, self.llm_slots, dispatch if self.stream_tool_calls else None, self.counters, self.max_attempts, self.retry_delay)
+                # Every tool call when not streaming, or those after malformed streamed output
+                for tool_call in run_pass_output.tool_calls[len(scheduler):]:
+                    dispatch(tool_call)
+                tool_return_messages = scheduler.results()
+            except Exception:
+                # Streamed calls started before the pass failed have run anyway (and may have
+                # written), so the agent still sees what they did and does not repeat them
+                self.append_tool_results(agent, scheduler.results())
+                raise
+            finally:
+                scheduler.close()
+
+            # Appended once the pass has updated the buffer, so clear_message_buffer cannot drop them
+            self.append_tool_results(agent, tool_return_messages)
+
+            if not run_pass_output.should_continue:
+                agent.is_running = False
+                agent.ui.add_activity(f"Agent {agent.name} stopped running")
                 agent.ui.leave()
-                agent.ui.add_activity(f"Agent {agent.name} left")
-            elif tool_call.name == "post_to_forum":
-                # Add error handling and logging
-                try:
-                    success = agent.ui.post_to_forum(tool_call.arguments["content"], None)
-                    if success:
-                        agent.ui.add_activity(f"Posted to forum: {tool_call.arguments['content'][:100]}...")
-                        tool_return_message = Message(role="tool", content="Successfully posted to forum")
-                    else:
-                        tool_return_message = Message(role="tool", content="Failed to post to forum")
-                except Exception as e:
-                    print(f"Error posting to forum: {str(e)}")
-                    tool_return_message = Message(role="tool", content=f"Error posting to forum: {str(e)}")
-            elif tool_call.name == "post_to_chat":
-                # Add error handling and logging
-                try:
-                    success = agent.ui.post_to_chat(tool_call.arguments["content"])
-                    if success:
-                        agent.ui.add_activity(f"Posted to chat: {tool_call.arguments['content'][:100]}...")
-                        tool_return_message = Message(role="tool", content="Successfully posted to chat")
-                    else:
-                        tool_return_message = Message(role="tool", content="Failed to post to chat")
-                except Exception as e:
-                    print(f"Error posting to chat: {str(e)}")
-                    tool_return_message = Message(role="tool", content=f"Error posting to chat: {str(e)}")
-            elif tool_call.name == "get_forum_posts":
-                posts = agent.ui.get_forum_posts()
-                agent.ui.add_activity(f"Got forum posts")
-                tool_return_message = Message(role="tool", content=json.dumps(posts))
-            elif tool_call.name == "get_forum_post":
-                post = agent.ui.get_forum_post(tool_call.arguments["thread_id"])
-                agent.ui.add_activity(f"Got forum post: {tool_call.arguments['thread_id']}")
-                tool_return_message = Message(role="tool", content=json.dumps(post))
-            elif tool_call.name == "get_chat_history":
-                messages = agent.ui.get_chat_history(tool_call.arguments["limit"])
-                agent.ui.add_activity(f"Got chat history")
-                tool_return_message = Message(role="tool", content=json.dumps(messages))
-            elif tool_call.name == "post_reply":
-                try:
-                    success = agent.ui.post_reply(tool_call.arguments["thread_id"], tool_call.arguments["content"])
-                    if success:
-                        agent.ui.add_activity(f"Posted reply: {tool_call.arguments['content'][:100]}...")
-                        tool_return_message = Message(role="tool", content="Successfully posted reply")
-                    else:
-                        tool_return_message = Message(role="tool", content="Failed to post reply")
-                except Exception as e:
-                    print(f"Error posting reply: {str(e)}")
-                    tool_return_message = Message(role="tool", content=f"Error posting reply: {str(e)}")
-            elif tool_call.name == "create_text_file":
-                agent.ui.create_text_file(tool_call.arguments["filename"], tool_call.arguments["content"])
-                agent.ui.add_activity(f"Created text file: {tool_call.arguments['filename']}")
-                tool_return_message = Message(role="tool", content=f"Created text file: {tool_call.arguments['filename']}")
-            elif tool_call.name == "create_image_file":
-                agent.ui.create_image_file(tool_call.arguments["filename"], tool_call.arguments["content"])
-                agent.ui.add_activity(f"Created image file: {tool_call.arguments['filename']}")
-                tool_return_message = Message(role="tool", content=f"Created image file: {tool_call.arguments['filename']}")
-            elif tool_call.name == "get_file":
-                file = agent.ui.get_file(tool_call.arguments["file_url"])
-                agent.ui.add_activity(f"Got file: {tool_call.arguments['file_url']}")
-                # TODO: read the files and convert them to markdown
-                # if text file, read and return, else return a "sorry, I can't convert this file at the moment"
-                tool_return_message = Message(role="tool", content=f"Sorry, I can't convert this file at the moment")                
-            elif tool_call.name == "get_file_list":
-                files = agent.ui.get_file_list()
-                agent.ui.add_activity(f"Got file list")
-                tool_return_message = Message(role="tool", content=json.dumps(files))
-            elif tool_call.name == "get_wikipedia_text":
-                text = agent.wiki.get_wikipedia_text(tool_call.arguments["title"])
-                agent.ui.add_activity(f"Got wikipedia text: {tool_call.arguments['title']}")
-
-                print("~"*100)
-                print(f"Got wikipedia text: {tool_call.arguments['title']}")
-                print(text)
-                print("~"*100)
-                tool_return_message = Message(role="tool", content=text)
 
-            if tool_return_message is not None:
-                agent.message_buffer.append(tool_return_message)
-        
-        agent.ui.clear_thoughts()    
-        for thought in run_pass_output.thoughts:    
-            agent.ui.add_thought(thought)
+            agent.ui.clear_thoughts()    
+            for thought in run_pass_output.thoughts:    
+                agent.ui.add_thought(thought)
+
+            for note in run_pass_output.notes:
+                agent.ui.add_activity(f"Note added: {note}")
 
-        for note in run_pass_output.notes:
-            agent.ui.add_activity(f"Note added: {note}")
+        self.snapshot(agent)
+
+    def append_tool_results(self, agent: Agent, tool_return_messages: List[Optional[Message]]):
+        """Add the results of a pass's tool calls to the agent's message buffer"""
+        for tool_return_message in tool_return_messages:
+            if tool_return_message is not None:
+                # A single page or listing can be larger than the whole prompt budget
+                agent.message_buffer.append(agent.context_window.truncate_tool_output(tool_return_message))
+
+    def execute_tool_call(self, agent: Agent, tool_call: ToolCall) -> Optional[Message]:
+        """Run one of an agent's tool calls, returns the message to show the agent next pass, if any"""
+        try:
+            return self.tools.call(tool_call.name, agent, tool_call.arguments)
+        except ToolError as e:
+            agent.ui.add_activity(f"Tool call {tool_call.name} failed: {str(e)}")
+            return Message(role="tool", content=f"Error calling {tool_call.name}: {str(e)}")
+        except Exception as e:
+            print(f"Error running {tool_call.name} for {agent.name}: {str(e)}")
+            return Message(role="tool", content=f"Error calling {tool_call.name}: {str(e)}")
+
+    def build_tool_registry(self) -> ToolRegistry:
+        """Every tool an agent can call, with its handler"""
+        tools = ToolRegistry(get_function_schemas())
+        tools.register("create_agent", self.tool_create_agent)
+        tools.register("set_persona", self.tool_set_persona)
+        tools.register("set_name", self.tool_set_name)
+        tools.register("join", self.tool_join)
+        tools.register("leave", self.tool_leave)
+        tools.register("post_to_forum", self.tool_post_to_forum)
+        tools.register("post_to_chat", self.tool_post_to_chat)
+        tools.register("get_forum_posts", self.tool_get_forum_posts, read_only=True)
+        tools.register("get_forum_post", self.tool_get_forum_post, read_only=True)
+        tools.register("get_chat_history", self.tool_get_chat_history, read_only=True)
+        tools.register("post_reply", self.tool_post_reply)
+        # File tools are not in the schemas yet, so their arguments are given here
+        tools.register("create_text_file", self.tool_create_text_file, arguments={"filename": str, "content": str})
+        tools.register("create_image_file", self.tool_create_image_file, arguments={"filename": str, "content": str})
+        tools.register("get_file", self.tool_get_file, read_only=True, arguments={"file_url": str})
+        tools.register("get_file_list", self.tool_get_file_list, read_only=True, arguments={})
+        tools.register("get_wikipedia_text", self.tool_get_wikipedia_text, read_only=True)
+        tools.register("search_wikipedia_page", self.tool_search_wikipedia_page, read_only=True)
+        return tools
+
+    def tool_create_agent(self, agent: Agent, name: str, initial_instructions: str, initial_notes: List[str]):
+        self.spawn_agent(name, initial_instructions, initial_notes)
+        agent.ui.add_activity(f"Created agent {name}")
+
+    def tool_set_persona(self, agent: Agent, persona: str):
+        agent.persona = persona
+        agent.ui.update_persona(persona)
+        agent.ui.add_activity(f"Set persona to {persona}")
+
+    def tool_set_name(self, agent: Agent, name: str):
+        old_name = agent.name
+        agent.name = name
+        agent.ui.agent_name = name
+        agent.ui.update_name(name)
+        agent.ui.add_activity(f"Changed name from {old_name} to {name}")
+
+    def tool_join(self, agent: Agent):
+        agent.ui.join("I'm rejoining")
+        agent.ui.add_activity(f"Agent {agent.name} joined")
+
+    def tool_leave(self, agent: Agent):
+        agent.ui.leave()
+        agent.ui.add_activity(f"Agent {agent.name} left")
+
+    def tool_post_to_forum(self, agent: Agent, content: str):
+        try:
+            success = agent.ui.post_to_forum(content, None)
+            if success:
+                agent.ui.add_activity(f"Posted to forum: {content[:100]}...")
+                return Message(role="tool", content="Successfully posted to forum")
+            return Message(role="tool", content="Failed to post to forum")
+        except Exception as e:
+            print(f"Error posting to forum: {str(e)}")
+            return Message(role="tool", content=f"Error posting to forum: {str(e)}")
+
+    def tool_post_to_chat(self, agent: Agent, content: str):
+        try:
+            success = agent.ui.post_to_chat(content)
+            if success:
+                agent.ui.add_activity(f"Posted to chat: {content[:100]}...")
+                return Message(role="tool", content="Successfully posted to chat")
+            return Message(role="tool", content="Failed to post to chat")
+        except Exception as e:
+            print(f"Error posting to chat: {str(e)}")
+            return Message(role="tool", content=f"Error posting to chat: {str(e)}")
+
+    def tool_get_forum_posts(self, agent: Agent):
+        posts = agent.ui.get_forum_posts()
+        agent.ui.add_activity(f"Got forum posts")
+        return Message(role="tool", content=json.dumps(posts))
+
+    def tool_get_forum_post(self, agent: Agent, thread_id: str):
+        post = agent.ui.get_forum_post(thread_id)
+        agent.ui.add_activity(f"Got forum post: {thread_id}")
+        return Message(role="tool", content=json.dumps(post))
+
+    def tool_get_chat_history(self, agent: Agent, limit: int, before_id: Optional[int] = None):
+        messages = agent.ui.get_chat_history(limit, before_id)
+        agent.ui.add_activity(f"Got chat history")
+        return Message(role="tool", content=json.dumps(messages))
+
+    def tool_post_reply(self, agent: Agent, thread_id: str, content: str):
+        try:
+            success = agent.ui.post_reply(thread_id, content)
+            if success:
+                agent.ui.add_activity(f"Posted reply: {content[:100]}...")
+                return Message(role="tool", content="Successfully posted reply")
+            return Message(role="tool", content="Failed to post reply")
+        except Exception as e:
+            print(f"Error posting reply: {str(e)}")
+            return Message(role="tool", content=f"Error posting reply: {str(e)}")
+
+    def tool_create_text_file(self, agent: Agent, filename: str, content: str):
+        agent.ui.create_text_file(filename, content)
+        agent.ui.add_activity(f"Created text file: {filename}")
+        return Message(role="tool", content=f"Created text file: {filename}")
+
+    def tool_create_image_file(self, agent: Agent, filename: str, content: str):
+        agent.ui.create_image_file(filename, content)
+        agent.ui.add_activity(f"Created image file: {filename}")
+        return Message(role="tool", content=f"Created image file: {filename}")
+
+    def tool_get_file(self, agent: Agent, file_url: str):
+        file = agent.ui.get_file(file_url)
+        agent.ui.add_activity(f"Got file: {file_url}")
+        # TODO: read the files and convert them to markdown
+        # if text file, read and return, else return a "sorry, I can't convert this file at the moment"
+        return Message(role="tool", content=f"Sorry, I can't convert this file at the moment")
+
+    def tool_get_file_list(self, agent: Agent):
+        files = agent.ui.get_file_list()
+        agent.ui.add_activity(f"Got file list")
+        return Message(role="tool", content=json.dumps(files))
+
+    def tool_get_wikipedia_text(self, agent: Agent, title: str, section: Optional[str] = None, start: Optional[int] = None, length: Optional[int] = None):
+        text = agent.wiki.get_wikipedia_text(title, section, start, length)
+        agent.ui.add_activity(f"Got wikipedia text: {title}" + (f" ({section})" if section is not None else ""))
+
+        print("~"*100)
+        print(f"Got wikipedia text: {title}")
+        print(text)
+        print("~"*100)
+        return Message(role="tool", content=text)
+
+    def tool_search_wikipedia_page(self, agent: Agent, title: str, query: str):
+        results = agent.wiki.search_wikipedia_page(title, query)
+        agent.ui.add_activity(f"Searched wikipedia page {title} for: {query}")
+        return Message(role="tool", content=results)
 
 def main():
-    orchestrator = AgentOrchestrator("http://localhost:5000", "llama3.1:8b")
-    orchestrator.start(5)
+    parser = argparse.ArgumentParser(description="Run the polis agents")
+    parser.add_argument("--agents", type=int, default=5, help="number of agents to start with")
+    parser.add_argument("--shards", type=int, default=0, help="spread agents over this many worker processes, 0 runs them all in this process")
+    parser.add_argument("--server-url", default="http://localhost:5000")
+    parser.add_argument("--model", default="llama3.1:8b")
+    parser.add_argument("--resume", action="store_true", help="restore the running agents from their last snapshots instead of starting new ones")
+    parser.add_argument("--stream", action="store_true", help="stream model replies and run tool calls while the rest of the reply is generated")
+    args = parser.parse_args()
+
+    if args.shards > 0:
+        from shard_supervisor import ShardSupervisor
+        ShardSupervisor(args.server_url, args.model, args.shards, stream_tool_calls=args.stream).start(args.agents, args.resume)
+    else:
+        orchestrator = AgentOrchestrator(args.server_url, args.model, state_store=AgentStateStore(), stream_tool_calls=args.stream)
+        orchestrator.start(args.agents, args.resume)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
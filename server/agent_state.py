@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Snapshots live next to the UI database
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'agent_state.db')
+
+
+class AgentStateStore:
+    """
+    Durable snapshots of orchestrator-side agent state (notes, message buffer, persona, ...).
+
+    save() only queues an agent's latest state, so it costs next to nothing on the pass that
+    calls it. A background thread writes whatever is queued every flush_interval seconds in one
+    transaction, as zlib-compressed JSON, skipping agents whose state has not changed since
+    their last snapshot. A crash loses at most the last flush_interval seconds.
+
+    Several processes (e.g. orchestrator shards) can share one store file.
+    """
+    def __init__(self, path=DEFAULT_STATE_PATH, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self.writes = 0
+        self.skipped = 0
+
+        self._pending = {}
+        self._digests = {}
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS agent_state (
+                agent_id TEXT PRIMARY KEY,
+                is_running INTEGER,
+                state BLOB,
+                updated_at REAL
+            )
+        ''')
+        self._conn.commit()
+
+    def start(self):
+        """Start the background writer, called lazily by save()"""
+        with self._pending_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="agent-state-writer", daemon=True)
+            self._thread.start()
+
+    def save(self, agent_id, state):
+        """
+        Queue a snapshot of an agent's state. state must be a JSON-serializable dict
+        that the caller will not mutate afterwards.
+        """
+        self.start()
+        with self._pending_lock:
+            self._pending[agent_id] = state
+
+    def run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write every queued snapshot now"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = []
+        now = time.time()
+        for agent_id, state in pending.items():
+            data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            if self._digests.get(agent_id) == digest:
+                self.skipped += 1
+                continue
+            self._digests[agent_id] = digest
+            rows.append((agent_id, 1 if state.get('is_running', True) else 0, zlib.compress(data), now))
+
+        if not rows:
+            return
+        try:
+            with self._db_lock, self._conn:
+                self._conn.executemany('''
+                    INSERT INTO agent_state (agent_id, is_running, state, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (agent_id) DO UPDATE SET
+                        is_running = excluded.is_running, state = excluded.state, updated_at = excluded.updated_at
+                ''', rows)
+            self.writes += len(rows)
+        except Exception as e:
+            # Queue these agents again for the next flush, unless a newer state was saved meanwhile,
+            # and forget their digests so they are not skipped
+            with self._pending_lock:
+                for row in rows:
+                    self._digests.pop(row[0], None)
+                    self._pending.setdefault(row[0], pending[row[0]])
+            print(f"Error writing agent state: {str(e)}")
+
+    def load(self, agent_id):
+        """Get an agent's latest snapshot, or None"""
+        with self._db_lock:
+            row = self._conn.execute('SELECT state FROM agent_state WHERE agent_id = ?', (agent_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def load_all(self, running_only=True):
+        """Get every agent's latest snapshot in the order they were first saved, optionally only agents still running"""
+        query = 'SELECT agent_id, state FROM agent_state'
+        if running_only:
+            query += ' WHERE is_running = 1'
+        with self._db_lock:
+            rows = self._conn.execute(query + ' ORDER BY rowid').fetchall()
+
+        states = []
+        for agent_id, blob in rows:
+            data = zlib.decompress(blob)
+            self._digests[agent_id] = hashlib.blake2b(data, digest_size=16).digest()
+            states.append(json.loads(data))
+        return states
+
+    def close(self):
+        """Stop the writer, write anything still queued and close the database"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
@@ -0,0 +1,296 @@
+"""
+End-to-end orchestrator benchmark against a mock Ollama server.
+
+Runs AgentOrchestrator passes for 10, 100 and 1000 agents against a local stand-in for
+the Ollama chat API that answers with scripted RunPassOutput JSON after a configurable
+latency, using only tools that touch the database. Everything is stored in a temporary
+directory. Reports passes per second, time spent in each phase of a pass and database
+queries per pass, so the orchestrator's own overhead can be told apart from the model's.
+
+    python benchmark.py --agents 10 100 1000 --ticks 3 --latency 0.05
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import agent_orchestrator
+from agent_orchestrator import Agent, AgentOrchestrator, initial_agent
+from agent_state import AgentStateStore
+from database import set_storage
+from libs.context_window import ContextWindow
+from storage import SQLiteStorage
+from ui_interface import UIInterface
+
+# Tool calls of the scripted passes, each agent pass gets the next one. Database tools only,
+# so the numbers do not depend on the network
+SCRIPT = [
+    [{"name": "post_to_chat", "arguments": {"content": "Hello from the benchmark"}}],
+    [{"name": "get_chat_history", "arguments": {"limit": 10}}, {"name": "get_forum_posts", "arguments": {}}],
+    [{"name": "post_to_forum", "arguments": {"content": "A benchmark thread"}}],
+    [{"name": "get_chat_history", "arguments": {"limit": 20}}, {"name": "post_to_chat", "arguments": {"content": "Another message"}}],
+]
+
+# Storage methods that write, the others only read
+WRITE_METHODS = [
+    "save_forum_thread", "save_forum_reply", "save_chat_message", "save_agent", "update_agent",
+    "append_agent_item", "rename_agent", "apply_agent_changes"
+]
+READ_METHODS = [
+    "get_forum_threads", "get_forum_thread", "get_recent_forum_threads", "get_forum_replies_since",
+    "get_chat_messages", "get_agents", "get_agents_since", "get_agent", "get_updates"
+]
+
+
+def scripted_reply(n):
+    return json.dumps({
+        "thoughts": [f"Thinking about pass {n}"],
+        "notes": [f"Note from pass {n}"] if n % 4 == 0 else [],
+        "tool_calls": SCRIPT[n % len(SCRIPT)],
+        "instructions_for_next_pass": "Keep going.",
+        "clear_message_buffer": False,
+        "delete_notes": [],
+        "clear_all_notes": False,
+        "should_continue": True
+    })
+
+
+class MockOllamaServer:
+    """
+    Answers POST /api/chat like Ollama, with scripted RunPassOutput JSON after latency seconds.
+    Streamed requests get the reply in NDJSON chunks spread over the latency.
+    """
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        mock = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with mock.lock:
+                    mock.requests += 1
+                    n = mock.requests
+                content = scripted_reply(n)
+
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.end_headers()
+                    pieces = [content[i:i + 64] for i in range(0, len(content), 64)]
+                    for piece in pieces:
+                        if mock.latency:
+                            time.sleep(mock.latency / len(pieces))
+                        self.write_line({"model": body["model"], "created_at": "2024-01-01T00:00:00Z", "message": {"role": "assistant", "content": piece}, "done": False})
+                    self.write_line({"model": body["model"], "created_at": "2024-01-01T00:00:00Z", "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"})
+                    return
+
+                if mock.latency:
+                    time.sleep(mock.latency)
+                data = json.dumps({"model": body["model"], "created_at": "2024-01-01T00:00:00Z", "message": {"role": "assistant", "content": content}, "done": True, "done_reason": "stop"}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def write_line(self, message):
+                self.wfile.write((json.dumps(message) + "\n").encode())
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-ollama", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class CountingSQLiteStorage(SQLiteStorage):
+    """SQLiteStorage that counts the statements run on its connections, by kind"""
+    def __init__(self, path):
+        super().__init__(path)
+        self.queries = Counter()
+        self.queries_lock = threading.Lock()
+
+    def connect(self):
+        conn = super().connect()
+        conn.set_trace_callback(self.count)
+        return conn
+
+    def count(self, statement):
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if kind in ("WITH", "SELECT"):
+            kind = "SELECT"
+        elif kind not in ("INSERT", "UPDATE", "DELETE"):
+            kind = "OTHER"
+        with self.queries_lock:
+            self.queries[kind] += 1
+
+    def reset_counts(self):
+        with self.queries_lock:
+            self.queries.clear()
+
+
+class PhaseTimer:
+    """
+    Total time spent in each phase, summed over every thread. Calls nested in a call
+    to the same phase are counted once.
+    """
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def wrap(self, phase, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            depth = getattr(self.local, phase, 0)
+            setattr(self.local, phase, depth + 1)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                setattr(self.local, phase, depth)
+                if depth == 0:
+                    elapsed = time.perf_counter() - start
+                    with self.lock:
+                        self.totals[phase] += elapsed
+                        self.calls[phase] += 1
+        return timed
+
+
+@contextlib.contextmanager
+def instrumented(timer, storage):
+    """Time the phases of a pass by wrapping the functions that make them up, restoring them afterwards"""
+    patches = [
+        (Agent, "get_system_prompt_massage", "prompt_build"),
+        (ContextWindow, "fit", "prompt_build"),
+        (ContextWindow, "num_ctx_for", "prompt_build"),
+        (agent_orchestrator, "call_ollama_chat", "llm_wait"),
+        (agent_orchestrator, "parse_run_pass_output", "validation"),
+        (AgentOrchestrator, "execute_tool_call", "tool_dispatch"),
+        (UIInterface, "flush_pass", "pass_flush"),
+        (AgentOrchestrator, "snapshot", "snapshot"),
+        (AgentOrchestrator, "run_agent", "pass"),
+    ]
+    originals = [(owner, name, owner.__dict__[name]) for owner, name, _ in patches]
+    try:
+        for owner, name, phase in patches:
+            setattr(owner, name, timer.wrap(phase, getattr(owner, name)))
+        # Instance attributes shadow the methods, so calls between storage methods are timed too
+        for name in WRITE_METHODS:
+            setattr(storage, name, timer.wrap("db_write", getattr(storage, name)))
+        for name in READ_METHODS:
+            setattr(storage, name, timer.wrap("db_read", getattr(storage, name)))
+        yield
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def run_benchmark(agent_count, ticks, latency, max_in_flight, stream):
+    """Run ticks passes of agent_count agents in a fresh polis, returns the measurements"""
+    workdir = tempfile.mkdtemp(prefix="polis-benchmark-")
+    mock = MockOllamaServer(latency).start()
+    storage = CountingSQLiteStorage(os.path.join(workdir, "ui.db"))
+    set_storage(storage)
+    state_store = AgentStateStore(os.path.join(workdir, "agent_state.db"))
+    orchestrator = AgentOrchestrator(mock.url, "mock", max_in_flight=max_in_flight, state_store=state_store, stream_tool_calls=stream)
+    timer = PhaseTimer()
+
+    try:
+        # Agents and tools print a line or more per call
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(agent_count):
+                orchestrator.create_agent(*initial_agent(i))
+
+            orchestrator.executor = ThreadPoolExecutor(max_workers=orchestrator.max_workers, thread_name_prefix="agent")
+            orchestrator.running = True
+            storage.reset_counts()
+            with instrumented(timer, storage):
+                start = time.perf_counter()
+                for _ in range(ticks):
+                    orchestrator.run_tick()
+                elapsed = time.perf_counter() - start
+    finally:
+        orchestrator.running = False
+        if orchestrator.executor is not None:
+            orchestrator.executor.shutdown(wait=True)
+        state_store.close()
+        mock.stop()
+        storage.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stats = orchestrator.get_stats()
+    return {
+        "agents": agent_count,
+        "passes": stats.get("passes", 0),
+        "failed_passes": stats.get("failed_passes", 0),
+        "seconds": elapsed,
+        "queries": dict(storage.queries),
+        "phases": {phase: {"calls": timer.calls[phase], "seconds": timer.totals[phase]} for phase in timer.totals}
+    }
+
+def print_result(result):
+    passes = max(result["passes"], 1)
+    queries = result["queries"]
+    total_queries = sum(queries.values())
+    print(f"\n{result['agents']} agents: {result['passes']} passes ({result['failed_passes']} failed) in {result['seconds']:.2f}s, {result['passes'] / result['seconds']:.1f} passes/s")
+    print(f"  queries/pass: {total_queries / passes:.1f} total, {queries.get('SELECT', 0) / passes:.1f} select, "
+          f"{(queries.get('INSERT', 0) + queries.get('UPDATE', 0) + queries.get('DELETE', 0)) / passes:.1f} write, {queries.get('OTHER', 0) / passes:.1f} other")
+    # Phases overlap (db_write runs inside tool_dispatch and pass_flush, everything inside pass)
+    # and are summed over threads, so they can add up to more than the wall time
+    print(f"  {'phase':<14}{'calls':>8}{'thread-s':>11}{'ms/call':>10}{'ms/pass':>10}")
+    for phase in ["pass", "prompt_build", "llm_wait", "validation", "tool_dispatch", "db_read", "db_write", "pass_flush", "snapshot"]:
+        if phase not in result["phases"]:
+            continue
+        calls = result["phases"][phase]["calls"]
+        seconds = result["phases"][phase]["seconds"]
+        print(f"  {phase:<14}{calls:>8}{seconds:>11.3f}{seconds * 1000 / calls:>10.3f}{seconds * 1000 / passes:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure orchestrator throughput against a mock Ollama server")
+    parser.add_argument("--agents", type=int, nargs="+", default=[10, 100, 1000], help="agent counts to run")
+    parser.add_argument("--ticks", type=int, default=3, help="passes per agent")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock server takes per reply")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="agents waiting on the mock server at once")
+    parser.add_argument("--stream", action="store_true", help="stream replies and run tool calls as they arrive")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for agent_count in args.agents:
+        result = run_benchmark(agent_count, args.ticks, args.latency, args.max_in_flight, args.stream)
+        results.append(result)
+        if not args.json:
+            print_result(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import threading
+from collections import deque
+
+
+class Subscription:
+    """A single client's queue of pending updates, bounded to backlog entries."""
+    def __init__(self, backlog: int):
+        self.backlog = backlog
+        self.updates = deque()
+        self.overflowed = False
+        self.condition = threading.Condition()
+
+    def put(self, update: dict):
+        with self.condition:
+            if len(self.updates) >= self.backlog:
+                # The client fell too far behind, drop its backlog and tell it to resync
+                self.updates.clear()
+                self.overflowed = True
+            else:
+                self.updates.append(update)
+            self.condition.notify()
+
+    def get(self, timeout: float) -> list:
+        """
+        Wait up to timeout for pending updates and return them as (event, data) pairs.
+        Returns a single ('resync', None) pair if updates were dropped.
+        """
+        with self.condition:
+            if not self.updates and not self.overflowed:
+                self.condition.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                self.updates.clear()
+                return [('resync', None)]
+            updates = [('update', update) for update in self.updates]
+            self.updates.clear()
+            return updates
+
+
+class ChangeFeed:
+    """
+    Watches the database for changes and pushes them to subscribed clients.
+
+    A single background thread compares the cheap data cursor against the last one it saw,
+    so writes from other processes (the orchestrator) are picked up within poll_interval.
+    Writes made in this process call notify() to be pushed immediately. Each change is
+    fetched once as a delta and fanned out to every subscriber.
+    """
+    def __init__(self, get_cursor, get_delta, poll_interval: float = 0.25, backlog: int = 256):
+        self.get_cursor = get_cursor
+        self.get_delta = get_delta
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="change-feed", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def notify(self):
+        """Wake the feed right away, called after a write in this process"""
+        self.wake.set()
+
+    def subscribe(self) -> Subscription:
+        # Started lazily so importing the server does not spawn threads
+        self.start()
+        subscription = Subscription(self.backlog)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def run(self):
+        cursor = self.get_cursor()
+        while self.running:
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+
+            try:
+                current = self.get_cursor()
+                if current == cursor:
+                    continue
+
+                with self.lock:
+                    subscribers = list(self.subscribers)
+                if not subscribers:
+                    # Nobody is listening, skip reading the changed rows
+                    cursor = current
+                    continue
+
+                update = self.get_delta(cursor)
+                cursor = update["cursor"]
+                for subscription in subscribers:
+                    subscription.put(update)
+            except Exception as e:
+                print(f"Error in change feed: {str(e)}")
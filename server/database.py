@@ -1,280 +1,158 @@
-import sqlite3
-from datetime import datetime
-import json
 import os
+from storage import open_storage
 
-# Get the absolute path for the database file
+# Get the absolute path for the default SQLite database file
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ui.db')
 
-# Ensure the data directory exists
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+# Where the polis is stored. Unset uses the SQLite file at DB_PATH. Point every process
+# (web server and orchestrators) at the same postgresql:// URL to run several orchestrator
+# processes against one polis, or at pgserver:///some/dir for an embedded PostgreSQL.
+# See storage.open_storage for the accepted URLs.
+DATABASE_URL = os.environ.get('POLIS_DATABASE_URL')
+
+_storage = None
+
+def get_storage():
+    """Get the storage backend every function in this module reads and writes through"""
+    global _storage
+    if _storage is None:
+        _storage = open_storage(DATABASE_URL, DB_PATH)
+    return _storage
+
+def set_storage(storage):
+    """Switch this process to another storage backend, creating its tables if needed"""
+    global _storage
+    _storage = storage
+    storage.init_db()
 
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Create tables
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS forum_threads (
-            thread_id TEXT PRIMARY KEY,
-            op_author TEXT,
-            op_content TEXT,
-            op_timestamp TEXT,
-            op_attachment TEXT
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS forum_replies (
-            reply_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            thread_id TEXT,
-            author TEXT,
-            content TEXT,
-            timestamp TEXT,
-            attachment TEXT,
-            FOREIGN KEY (thread_id) REFERENCES forum_threads(thread_id)
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            message TEXT,
-            timestamp TEXT
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS agents (
-            agent_id TEXT,
-            name TEXT,
-            persona TEXT,
-            thoughts TEXT,
-            activity TEXT,
-            latest_activity TEXT,
-            left BOOLEAN DEFAULT FALSE,
-            joined_at TEXT,
-            left_timestamp TEXT,
-            PRIMARY KEY (agent_id, name)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def dict_factory(cursor, row):
-    """Convert database rows to dictionaries"""
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+    get_storage().init_db()
 
 def get_db():
-    """Get database connection with row factory set"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = dict_factory
-    return conn
+    """Get this thread's database connection, opening it on first use"""
+    return get_storage().get_connection()
+
+def close_db():
+    """Close this thread's database connection, if it has one"""
+    get_storage().close()
+
+def read_snapshot():
+    """Run several reads against one consistent snapshot of the database"""
+    return get_storage().read_snapshot()
+
+# Callbacks run after this process commits a change, e.g. to wake the web server's change feed
+_change_listeners = []
+
+def add_change_listener(callback):
+    """Register a callback to run after every write made by this process"""
+    _change_listeners.append(callback)
+
+def notify_change():
+    for callback in _change_listeners:
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in change listener: {str(e)}")
 
 def save_forum_thread(thread_data):
     """Save a forum thread to the database"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Save thread
-    c.execute('''
-        INSERT INTO forum_threads (thread_id, op_author, op_content, op_timestamp, op_attachment)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        thread_data['threadId'],
-        thread_data['op']['author'],
-        thread_data['op']['content'],
-        thread_data['op']['timestamp'],
-        json.dumps(thread_data['op'].get('attachment')) if thread_data['op'].get('attachment') else None
-    ))
-    
-    conn.commit()
-    conn.close()
+    get_storage().save_forum_thread(thread_data)
+    notify_change()
+
+def get_forum_threads(limit=None, offset=0, after_seq=None, before_seq=None):
+    """
+    Get forum threads with their replies, newest thread first, optionally one page at a time.
+    If after_seq is given, only threads created after that sequence number are returned,
+    and if before_seq is given only those created before it (paging back).
+    """
+    return get_storage().get_forum_threads(limit, offset, after_seq, before_seq)
 
-def get_forum_threads():
-    """Get all forum threads with their replies"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Get all threads with current agent names
-    threads = c.execute('''
-        SELECT t.*, 
-               CASE 
-                   WHEN t.op_author LIKE '[Agent]%' THEN 
-                       COALESCE(
-                           (SELECT '[Agent] ' || a.name 
-                            FROM agents a 
-                            WHERE a.agent_id = SUBSTR(t.op_author, 8)), 
-                           t.op_author)
-                   ELSE t.op_author 
-               END as op_author
-        FROM forum_threads t
-    ''').fetchall()
-    
-    # Get replies for each thread with current agent names
-    for thread in threads:
-        replies = c.execute('''
-            SELECT r.*,
-                   CASE 
-                       WHEN r.author LIKE '[Agent]%' THEN 
-                           COALESCE(
-                               (SELECT '[Agent] ' || a.name 
-                                FROM agents a 
-                                WHERE a.agent_id = SUBSTR(r.author, 8)), 
-                               r.author)
-                       ELSE r.author 
-                   END as author
-            FROM forum_replies r 
-            WHERE r.thread_id = ? 
-            ORDER BY timestamp
-        ''', (thread['thread_id'],)).fetchall()
-        
-        # Convert attachment JSON strings back to dictionaries
-        if thread['op_attachment']:
-            thread['op_attachment'] = json.loads(thread['op_attachment'])
-        
-        # Restructure thread to match original format
-        thread['threadId'] = thread['thread_id']
-        thread['op'] = {
-            'author': thread['op_author'],
-            'content': thread['op_content'],
-            'timestamp': thread['op_timestamp'],
-        }
-        if thread['op_attachment']:
-            thread['op']['attachment'] = thread['op_attachment']
-            
-        thread['replies'] = replies
-        
-        # Clean up raw database fields
-        del thread['thread_id']
-        del thread['op_author']
-        del thread['op_content']
-        del thread['op_timestamp']
-        del thread['op_attachment']
-    
-    conn.close()
-    return threads
+def get_forum_thread(thread_id):
+    """Get a single thread with all its replies by primary key. Returns None if not found"""
+    return get_storage().get_forum_thread(thread_id)
+
+def get_recent_forum_threads(limit=30, replies_per_thread=2):
+    """Get the limit most recent threads, each with only its replies_per_thread latest replies"""
+    return get_storage().get_recent_forum_threads(limit, replies_per_thread)
+
+def get_forum_replies_since(reply_id):
+    """Get every reply posted after reply_id, oldest first, with its thread_id"""
+    return get_storage().get_forum_replies_since(reply_id)
 
 def save_forum_reply(thread_id, reply_data):
     """Save a forum reply to the database"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    c.execute('''
-        INSERT INTO forum_replies (thread_id, author, content, timestamp, attachment)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        thread_id,
-        reply_data['author'],
-        reply_data['content'],
-        reply_data['timestamp'],
-        json.dumps(reply_data.get('attachment')) if reply_data.get('attachment') else None
-    ))
-    
-    conn.commit()
-    conn.close()
+    get_storage().save_forum_reply(thread_id, reply_data)
+    notify_change()
 
 def save_chat_message(message_data):
     """Save a chat message to the database"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    c.execute('''
-        INSERT INTO chat_messages (sender, message, timestamp)
-        VALUES (?, ?, ?)
-    ''', (
-        message_data['sender'],
-        message_data['message'],
-        message_data['timestamp']
-    ))
-    
-    conn.commit()
-    conn.close()
+    get_storage().save_chat_message(message_data)
+    notify_change()
 
-def get_chat_messages(limit=None):
-    """Get chat messages, optionally limited to N most recent"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    if limit:
-        messages = c.execute(
-            'SELECT * FROM chat_messages ORDER BY timestamp DESC LIMIT ?',
-            (limit,)
-        ).fetchall()
-    else:
-        messages = c.execute('SELECT * FROM chat_messages ORDER BY timestamp').fetchall()
-    
-    conn.close()
-    return messages
+def get_chat_messages(limit=None, before_id=None, after_id=None):
+    """
+    Get chat messages, always ordered oldest first by message_id.
+    See Storage.get_chat_messages for how limit, before_id and after_id combine.
+    """
+    return get_storage().get_chat_messages(limit, before_id, after_id)
 
 def save_agent(agent_data, all_agents=None):
     """Save or update an agent in the database"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    try:
-        if all_agents is not None:
-            # First delete the old agent entry
-            c.execute('DELETE FROM agents WHERE agent_id = ?', (agent_data.get('id'),))
-            
-        # Insert or update the agent
-        c.execute('''
-            INSERT OR REPLACE INTO agents 
-            (agent_id, name, persona, thoughts, activity, latest_activity, left, joined_at, left_timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            agent_data.get('id'),
-            agent_data.get('name'),
-            agent_data.get('persona'),
-            json.dumps(agent_data.get('thoughts', [])),
-            json.dumps(agent_data.get('activity', [])),
-            agent_data.get('latestActivity'),
-            agent_data.get('left', False),
-            agent_data.get('joinedAt'),
-            agent_data.get('leftTimestamp')
-        ))
-        
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"Error saving agent: {str(e)}")
-        return False
-    finally:
-        conn.close()
+    saved = get_storage().save_agent(agent_data, all_agents)
+    if saved:
+        notify_change()
+    return saved
 
 def get_agents(active_only=True):
     """Get all agents, optionally filtering to only active ones"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    if active_only:
-        agents = c.execute('SELECT * FROM agents WHERE left = 0 ORDER BY latest_activity DESC').fetchall()
-    else:
-        agents = c.execute('SELECT * FROM agents ORDER BY latest_activity DESC').fetchall()
-    
-    # Convert JSON strings back to lists
-    for agent in agents:
-        agent['thoughts'] = json.loads(agent['thoughts']) if agent['thoughts'] else []
-        agent['activity'] = json.loads(agent['activity']) if agent['activity'] else []
-        agent['id'] = agent['agent_id']
-        agent['joinedAt'] = agent['joined_at']
-        agent['leftTimestamp'] = agent['left_timestamp']
-        agent['latestActivity'] = agent['latest_activity']
-        
-        # Clean up raw database fields
-        del agent['agent_id']
-        del agent['joined_at']
-        del agent['left_timestamp']
-        del agent['latest_activity']
-    
-    conn.close()
-    return agents
+    return get_storage().get_agents(active_only)
+
+def get_agents_since(version):
+    """Get every agent, active or not, whose row changed after version, oldest change first"""
+    return get_storage().get_agents_since(version)
+
+def get_agent(agent_id, name=None):
+    """Get a single agent by id, and by name if given. Returns None if not found"""
+    return get_storage().get_agent(agent_id, name)
+
+def update_agent(agent_id, fields, name=None):
+    """Update only the given fields of one agent. Returns True if the agent was found"""
+    updated = get_storage().update_agent(agent_id, fields, name)
+    notify_change()
+    return updated
+
+def append_agent_item(agent_id, name, field, item, max_items=5, latest_activity=None):
+    """Append to an agent's thoughts or activity list, keeping only the last max_items"""
+    appended = get_storage().append_agent_item(agent_id, name, field, item, max_items, latest_activity)
+    notify_change()
+    return appended
+
+def rename_agent(agent_id, name):
+    """Rename an agent, collapsing any other rows it has under old names"""
+    renamed = get_storage().rename_agent(agent_id, name)
+    notify_change()
+    return renamed
+
+def apply_agent_changes(agent_id, name, changes, max_items=5):
+    """
+    Apply a batch of buffered changes to one agent in a single transaction.
+    See Storage.apply_agent_changes for the keys changes may contain.
+    """
+    applied = get_storage().apply_agent_changes(agent_id, name, changes, max_items)
+    notify_change()
+    return applied
+
+def get_data_cursor():
+    """Get the latest chat message id, thread sequence, reply id and agent version"""
+    return get_storage().get_data_cursor()
+
+def get_updates(since):
+    """
+    Get everything that changed after the since cursor (as returned by get_data_cursor),
+    along with the new cursor, all read from one consistent snapshot.
+    """
+    return get_storage().get_updates(since)
 
 # Initialize database when module is imported
-init_db() 
\ No newline at end of file
+init_db()
\ No newline at end of file
@@ -1,15 +1,131 @@
-from ollama import Client
+from ollama import Client, AsyncClient
+import asyncio
 import random
+import threading
+import weakref
+import httpx
 from pydantic import BaseModel
 from markitdown import MarkItDown
 import semchunk
 
+# Connection pool limits for each Ollama server, shared by every thread using the client
+OLLAMA_MAX_CONNECTIONS = 32
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = 16
+OLLAMA_KEEPALIVE_EXPIRY = 60.0
+
+# Context window requested when the caller does not size one for its prompt
+DEFAULT_NUM_CTX = 100000
+
+_clients = {}
+# Event loop -> {server_url: AsyncClient}, dropped along with the loop
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+    )
+
+def get_ollama_client(server_url):
+    """Get the shared, thread-safe Ollama client for server_url, creating it on first use"""
+    client = _clients.get(server_url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(server_url)
+            if client is None:
+                client = Client(host=server_url, limits=_pool_limits())
+                _clients[server_url] = client
+    return client
+
+def get_async_ollama_client(server_url):
+    """Get the shared async Ollama client for server_url on the running event loop"""
+    # httpx async pools are bound to the loop they were created on
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(server_url)
+        if client is None:
+            client = AsyncClient(host=server_url, limits=_pool_limits())
+            loop_clients[server_url] = client
+    return client
+
+async def close_async_ollama_clients():
+    """Close the async clients of the running event loop"""
+    with _clients_lock:
+        clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client._client.aclose()
+
+def close_ollama_clients():
+    """
+    Close the pooled sync clients, and the async clients of every event loop that is still open,
+    each on its own loop. Call close_async_ollama_clients instead from inside a loop.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client._client.close()
+        _clients.clear()
+        loops = list(_async_clients.items())
+        _async_clients.clear()
 
-def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None):
     try:
-        client = Client(
-            host=server_url
-        )
+        current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        current_loop = None
+    for loop, loop_clients in loops:
+        if loop.is_closed():
+            # Its connections went with it
+            continue
+        for client in loop_clients.values():
+            if loop is current_loop:
+                # Waiting here would block the loop, the close runs once the caller yields
+                loop.create_task(client._client.aclose())
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(client._client.aclose(), loop).result()
+            else:
+                loop.run_until_complete(client._client.aclose())
+
+def _chat_options(num_ctx=None):
+    return {
+        'num_ctx': num_ctx if num_ctx else DEFAULT_NUM_CTX,
+        'seed': random.randint(0, 1000000)
+    }
+
+class OllamaUnavailable(Exception):
+    """The Ollama server could not be reached or failed to answer"""
+
+def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None, num_ctx=None, on_chunk=None):
+    """
+    Get the model's reply to messages. With on_chunk, the reply is streamed and on_chunk is
+    called with each piece of text as it is generated; the full reply is still returned, or as
+    much of it as arrived if the stream breaks off. Raises OllamaUnavailable if the server cannot be reached or fails, so callers can tell
+    an outage apart from a bad reply.
+    """
+    try:
+        client = get_ollama_client(server_url)
+
+        if on_chunk is not None:
+            parts = []
+            try:
+                for part in client.chat(
+                    model='huggingface.co/bartowski/Qwen2.5-14B-Instruct-1M-GGUF',
+                    stream=True,
+                    messages=messages,
+                    format=json_schema,
+                    tools=tools,
+                    options=_chat_options(num_ctx)):
+                    if part.message.content:
+                        parts.append(part.message.content)
+                        on_chunk(part.message.content)
+            except Exception as error:
+                if not parts:
+                    raise
+                # on_chunk may already have acted on what arrived, so hand it back for the caller
+                # to rebuild those parts of the reply from
+                print(f"Reply stream broke off after {len(parts)} chunks: {error}")
+            return "".join(parts)
         
         response = client.chat(
             #model='huggingface.co/unsloth/DeepSeek-R1-Distill-Qwen-14B-GGUF:Q8_0', 
@@ -19,10 +135,28 @@ def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=
             messages=messages,
             format=json_schema,
             tools=tools,
-            options={
-                'num_ctx':100000,
-                'seed': random.randint(0, 1000000)
-            })
+            options=_chat_options(num_ctx))
+
+        return response.message.content
+
+    except Exception as error:
+        print("~~~~~~~~~~~~~~~~~~~~~~~")
+        print("Error")
+        print(error)
+        print("~~~~~~~~~~~~~~~~~~~~~~~")
+        raise OllamaUnavailable(str(error)) from error
+
+async def call_ollama_chat_async(server_url, model, messages, json_schema=None, temperature=None, tools=None, num_ctx=None):
+    try:
+        client = get_async_ollama_client(server_url)
+
+        response = await client.chat(
+            model='huggingface.co/bartowski/Qwen2.5-14B-Instruct-1M-GGUF',
+            stream=False,
+            messages=messages,
+            format=json_schema,
+            tools=tools,
+            options=_chat_options(num_ctx))
 
         return response.message.content
 
@@ -34,11 +168,33 @@ def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=
         return "error"
     
 def embed_with_ollama(server_url, text, model="nomic-embed-text"):
-    client = Client(
-        host=server_url
+    client = get_ollama_client(server_url)
+
+    results = client.embed(
+        model=model,
+        input=text
     )
 
+    return results["embeddings"][0]
+
+def embed_batch_with_ollama(server_url, texts, model="nomic-embed-text"):
+    """Embed a list of texts in a single request, returns embeddings in input order"""
+    if not texts:
+        return []
+
+    client = get_ollama_client(server_url)
+
     results = client.embed(
+        model=model,
+        input=texts
+    )
+
+    return results["embeddings"]
+
+async def embed_with_ollama_async(server_url, text, model="nomic-embed-text"):
+    client = get_async_ollama_client(server_url)
+
+    results = await client.embed(
         model=model,
         input=text
     )
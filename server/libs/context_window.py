@@ -0,0 +1,80 @@
+# Rough characters per token for English text and JSON, close enough for budgeting
+CHARS_PER_TOKEN = 4
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Room always left for the newest message, even when the system prompt alone fills the budget
+MIN_MESSAGE_TOKENS = 256
+
+def estimate_tokens(text):
+    """Estimate the token count of text from its length, without running a tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_text(text, max_tokens):
+    """Cut text down to about max_tokens, keeping its start and end and noting what was cut"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    # The start of a page or listing usually matters most, keep some of the end for context
+    head = max_chars * 3 // 4
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n\n[... {omitted} characters omitted ...]\n\n{text[-tail:]}"
+
+
+class ContextWindow:
+    """
+    Keeps an agent's prompt within a token budget and sizes num_ctx to fit it.
+
+    Token counts are estimated from text length, so the budget should leave some headroom.
+    num_ctx is rounded up to a power of two no smaller than min_num_ctx: Ollama reloads a
+    model whenever num_ctx changes, so requests should share a few sizes rather than each
+    get an exact one. With the defaults every prompt trimmed to the budget fits in min_num_ctx.
+    """
+    def __init__(self, budget_tokens=12288, max_tool_tokens=3072, max_messages=20, response_tokens=2048, min_num_ctx=16384, max_num_ctx=100000):
+        self.budget_tokens = budget_tokens
+        self.max_tool_tokens = max_tool_tokens
+        self.max_messages = max_messages
+        self.response_tokens = response_tokens
+        self.min_num_ctx = min_num_ctx
+        self.max_num_ctx = max_num_ctx
+
+    def truncate_tool_output(self, message):
+        """Return message with its content cut to max_tool_tokens, or message itself if it already fits"""
+        if estimate_tokens(message.content) <= self.max_tool_tokens:
+            return message
+        return message.model_copy(update={"content": truncate_text(message.content, self.max_tool_tokens)})
+
+    def fit(self, system_prompt, messages):
+        """
+        Return the most recent messages, at most max_messages, that fit in the budget alongside
+        system_prompt. If not even the newest message fits, it is kept truncated to the room left.
+        """
+        messages = messages[-self.max_messages:]
+        available = self.budget_tokens - estimate_message_tokens(system_prompt)
+
+        kept = []
+        for message in reversed(messages):
+            tokens = estimate_message_tokens(message)
+            if tokens > available:
+                break
+            kept.append(message)
+            available -= tokens
+        kept.reverse()
+
+        if not kept and messages:
+            room = max(available - MESSAGE_OVERHEAD_TOKENS, MIN_MESSAGE_TOKENS)
+            newest = messages[-1]
+            kept = [newest.model_copy(update={"content": truncate_text(newest.content, room)})]
+        return kept
+
+    def num_ctx_for(self, messages):
+        """Context size for a request with these messages, leaving room for the response"""
+        needed = sum(estimate_message_tokens(message) for message in messages) + self.response_tokens
+        num_ctx = self.min_num_ctx
+        while num_ctx < needed and num_ctx < self.max_num_ctx:
+            num_ctx *= 2
+        return min(num_ctx, self.max_num_ctx)
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# Shared on-disk cache next to the UI database
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'embedding_cache.db')
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+
+    Embeddings are keyed by (model, prefix, sha256 of text) and stored as float32 blobs in
+    SQLite, with an in-memory LRU in front. The on-disk store is bounded to max_entries and
+    evicts the least recently used entries when it grows past that. Several processes can
+    share the store, so the entry count is taken again from the table now and then.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=4096, max_entries=200000):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                embedding BLOB,
+                last_used REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)')
+        self._conn.commit()
+        self._disk_entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        # Entries this process added since the count was last taken
+        self._uncounted = 0
+
+    @staticmethod
+    def make_key(model, prefix, text):
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{model}\x00{prefix}\x00{text_hash}"
+
+    def get_many(self, model, prefix, texts):
+        """Look up embeddings for texts, returns a list with None for every miss"""
+        keys = [self.make_key(model, prefix, text) for text in texts]
+        results = [None] * len(keys)
+
+        with self._lock:
+            disk_lookups = {}
+            for i, key in enumerate(keys):
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = embedding
+                else:
+                    disk_lookups.setdefault(key, []).append(i)
+
+            if disk_lookups:
+                found = self._read_disk(list(disk_lookups))
+                for key, embedding in found.items():
+                    for i in disk_lookups[key]:
+                        results[i] = embedding
+                    self._remember(key, embedding)
+
+            hits = sum(1 for embedding in results if embedding is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(self, model, prefix, texts, embeddings):
+        """Store embeddings for texts"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model, prefix, text)
+                embedding = list(embedding)
+                self._remember(key, embedding)
+                rows.append((key, model, array('f', embedding).tobytes(), now))
+
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO embeddings (key, model, embedding, last_used) VALUES (?, ?, ?, ?)', rows)
+            inserted = self._conn.total_changes - before
+            self._disk_entries += inserted
+            self._uncounted += inserted
+            self._conn.commit()
+
+            # Other processes add entries this one does not see, so recount every so often too
+            if self._disk_entries > self.max_entries or self._uncounted > self.max_entries // 10:
+                self._evict()
+
+    def stats(self):
+        """Return hit/miss counters and current sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_entries
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.commit()
+            self._disk_entries = 0
+            self._uncounted = 0
+
+    def _read_disk(self, keys):
+        found = {}
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f'SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})', batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array('f', blob).tolist()
+
+        if found:
+            now = time.time()
+            self._conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+            self._conn.commit()
+        return found
+
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        # Count inside the write transaction, so other processes cannot change it before the delete
+        excess = 0
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if count > self.max_entries:
+                # Trim to 90% of the bound so eviction does not run on every insert
+                excess = count - int(self.max_entries * 0.9)
+                self._conn.execute('''
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                    )
+                ''', (excess,))
+        self._disk_entries = count - excess
+        self._uncounted = 0
+        self.evictions += excess
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    """Get the process-wide embedding cache at DEFAULT_CACHE_PATH"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
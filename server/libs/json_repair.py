@@ -0,0 +1,84 @@
+import re
+
+# A complete JSON string, with escapes
+STRING = r'"(?:[^"\\]|\\.)*"'
+
+def repair_json(text):
+    """
+    Best-effort fix for the usual defects in model generated JSON: markdown code fences,
+    text around the object, trailing commas, and output cut off part way (an unclosed
+    string, objects and arrays left open, a dangling key, comma or partial literal).
+    Returns the repaired text, which is not guaranteed to parse.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if "```" in text:
+            text = text[:text.rindex("```")]
+
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+
+    out = []
+    closers = []
+    in_string = False
+    escaped = False
+    for c in text:
+        if in_string:
+            out.append(c)
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+            continue
+
+        if c == '"':
+            in_string = True
+        elif c in '{[':
+            closers.append('}' if c == '{' else ']')
+        elif c in '}]':
+            _strip_trailing_comma(out)
+            if closers:
+                closers.pop()
+            out.append(c)
+            if not closers:
+                # Anything after the top-level object is commentary
+                break
+            continue
+        out.append(c)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+
+    repaired = "".join(out)
+    if closers:
+        repaired = _trim_dangling(repaired, closers[-1]) + "".join(reversed(closers))
+    return repaired
+
+def _strip_trailing_comma(out):
+    while out and out[-1] in ' \t\r\n':
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+def _trim_dangling(text, closer):
+    """Drop whatever incomplete member or element the text was cut off in"""
+    while True:
+        before = text
+        text = text.rstrip()
+        text = re.sub(r',$', '', text)
+        # A key whose value never arrived
+        text = re.sub(STRING + r'\s*:$', '', text)
+        # A literal cut off part way
+        text = re.sub(r'(?<=[:\[,{])\s*(?:t|tr|tru|f|fa|fal|fals|n|nu|nul)$', '', text)
+        if closer == '}':
+            # A key without its colon
+            text = re.sub(r'(?<=[{,])\s*' + STRING + '$', '', text)
+        if text == before:
+            return text
@@ -0,0 +1,76 @@
+import json
+
+
+class ArrayItemScanner:
+    """
+    Scans a JSON object as it streams in and returns the items of one of its top-level
+    arrays (e.g. "tool_calls") as soon as each item's closing brace arrives.
+
+    Only object items are returned. If an item does not parse, the scanner marks itself
+    failed and returns nothing more; the caller should fall back to parsing the full text.
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_string = None
+        self.current_key = None
+        self.in_array = False
+        self.item_start = None
+        self.items_found = 0
+        self.failed = False
+
+    def feed(self, chunk: str) -> list:
+        """Add streamed text, returns the items completed by it"""
+        if self.failed:
+            return []
+        self.buffer += chunk
+        items = []
+
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            c = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == '\\':
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = buffer[self.string_start:i]
+                continue
+
+            if c == '"':
+                self.in_string = True
+                self.string_start = i + 1
+            elif c == ':' and self.depth == 1:
+                # The string just before a colon at the top level is a key
+                self.current_key = self.last_string
+            elif c == ',' and self.depth == 1:
+                self.current_key = None
+            elif c in '{[':
+                self.depth += 1
+                if c == '[' and self.depth == 2 and self.current_key == self.key:
+                    self.in_array = True
+                elif c == '{' and self.depth == 3 and self.in_array:
+                    self.item_start = i
+            elif c in '}]':
+                if c == '}' and self.depth == 3 and self.item_start is not None:
+                    try:
+                        items.append(json.loads(buffer[self.item_start:i + 1]))
+                    except json.JSONDecodeError:
+                        self.failed = True
+                        break
+                    self.item_start = None
+                self.depth -= 1
+                if self.depth == 1:
+                    self.in_array = False
+
+        self.position = len(buffer)
+        self.items_found += len(items)
+        return items
@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Shared on-disk cache next to the UI database
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'page_cache.db')
+
+
+class PageCache:
+    """
+    Persistent cache of fetched pages (e.g. Wikipedia articles), keyed by a string.
+
+    Pages are JSON-serializable dicts, stored zlib-compressed in SQLite. A page expires ttl
+    seconds after it was fetched. The store is bounded to max_bytes of compressed pages and
+    evicts the least recently used pages when it grows past that.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                page BLOB,
+                size INTEGER,
+                fetched_at REAL,
+                last_used REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_last_used ON pages(last_used)')
+        self._conn.commit()
+        self._bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def get(self, key):
+        """Get a cached page, or None if it is not cached or has expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT page, size, fetched_at FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            blob, size, fetched_at = row
+            if now - fetched_at > self.ttl:
+                self._conn.execute('DELETE FROM pages WHERE key = ?', (key,))
+                self._conn.commit()
+                self._bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE pages SET last_used = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(blob))
+
+    def put(self, key, page):
+        """Store a page"""
+        blob = zlib.compress(json.dumps(page, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM pages WHERE key = ?', (key,)).fetchone()
+            self._conn.execute('''
+                INSERT INTO pages (key, page, size, fetched_at, last_used) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    page = excluded.page, size = excluded.size, fetched_at = excluded.fetched_at, last_used = excluded.last_used
+            ''', (key, blob, len(blob), now, now))
+            self._conn.commit()
+            self._bytes += len(blob) - (row[0] if row else 0)
+
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0],
+                "bytes": self._bytes
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM pages')
+            self._conn.commit()
+            self._bytes = 0
+
+    def _evict(self):
+        # Trim to 90% of the bound so eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        evicted = []
+        for key, size in self._conn.execute('SELECT key, size FROM pages ORDER BY last_used'):
+            if self._bytes <= target:
+                break
+            evicted.append((key,))
+            self._bytes -= size
+        self._conn.executemany('DELETE FROM pages WHERE key = ?', evicted)
+        self._conn.commit()
+        self.evictions += len(evicted)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_page_cache():
+    """Get the process-wide page cache at DEFAULT_CACHE_PATH"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = PageCache()
+        return _shared_cache
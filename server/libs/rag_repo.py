@@ -1,26 +1,49 @@
 import uuid
 import os
 import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 from chromadb.config import Settings
 
-from common import convert_file, chunk_text, embed_with_ollama
+from common import convert_file, chunk_text, embed_batch_with_ollama
+from embedding_cache import get_shared_cache
 
 import warnings
 warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 
 
 class RagRepo:
-    def __init__(self, repo_path, llm_server, embedding_model):
+    def __init__(self, repo_path, llm_server, embedding_model, embed_batch_size=64, max_workers=4, embedding_cache=None, persistent=True):
         self.repo_path = repo_path
         self.llm_server = llm_server
         self.embedding_model = embedding_model
+        # Defaults to the process-wide cache so repos and agents share embeddings
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_shared_cache()
+        # Chunks sent per embed request, and files ingested concurrently
+        self.embed_batch_size = embed_batch_size
+        self.max_workers = max_workers
+        self.collection_lock = threading.Lock()
+        self.persistent = persistent
 
-        # Initialize the Chroma client in-memory (no persistence)
-        self.chroma_client = chromadb.Client()
+        if persistent:
+            # Vectors and the per-file manifest live under repo_path and survive restarts
+            os.makedirs(repo_path, exist_ok=True)
+            self.chroma_client = chromadb.PersistentClient(path=os.path.join(repo_path, "chroma"))
+            self.manifest_path = os.path.join(repo_path, "manifest.json")
+        else:
+            # Initialize the Chroma client in-memory (no persistence)
+            self.chroma_client = chromadb.Client()
+            self.manifest_path = None
 
         # Create or load a collection
-        self.collection = self.chroma_client.create_collection(name="rag_collection")
+        self.collection = self.chroma_client.get_or_create_collection(name="rag_collection")
+
+        # Indexed files: absolute path -> {"sha256", "mtime", "size", "chunks"}
+        self.manifest = self.load_manifest()
+        self.manifest_lock = threading.Lock()
 
     def get_function_schemas(self):
         """
@@ -46,46 +69,165 @@ class RagRepo:
             "description": "Add files to the RAG repository"
         }]
 
+    def load_manifest(self):
+        if self.manifest_path is None or not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def save_manifest(self):
+        if self.manifest_path is None:
+            return
+        with self.manifest_lock:
+            # Write then rename so a crash never leaves a truncated manifest
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
     def add_files(self, files):
         """
-        Convert, chunk, and embed each file, then store the vectors in Chroma.
+        Convert, chunk, and embed each new or changed file, then store the vectors in Chroma.
+        Unchanged files are skipped, and vectors for indexed files that no longer exist are deleted.
+        Files are processed concurrently, chunks are embedded and stored in batches.
+        Returns the files that were (re)indexed.
         """
-        for file in files:
-            # Convert file to Markdown/text
-            md_text = convert_file(file)
-
-            # Chunk it up
-            chunks = chunk_text(md_text, chunk_size=1024, overlap=100)
-
-            # Embed each chunk and add to the collection
-            for i, chunk in enumerate(chunks):
-                embedding = embed_with_ollama(
-                    server_url=self.llm_server,
-                    text="search_document: " + chunk, # prefix for nomic-embed-text
-                    model=self.embedding_model
-                )
+        self.remove_missing_files()
+
+        # The same file given twice (or by two paths) must not be ingested by two workers at once
+        changed = list(dict.fromkeys(os.path.abspath(file) for file in files if self.needs_indexing(file)))
+        if len(changed) <= 1 or self.max_workers <= 1:
+            for file in changed:
+                self.add_file(file)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(changed))) as executor:
+                # list() surfaces any exception raised while ingesting a file
+                list(executor.map(self.add_file, changed))
+
+        self.save_manifest()
+        return changed
+
+    def needs_indexing(self, file):
+        """
+        Check a file against the manifest, by mtime and size first and by content hash
+        only when those differ, so untouched files are never re-read.
+        """
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        entry = self.manifest.get(path)
+        if entry is None:
+            return True
+        if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return False
+        if entry["sha256"] == self.hash_file(path):
+            # Touched but not modified, remember the new mtime
+            with self.manifest_lock:
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+            return False
+        return True
+
+    @staticmethod
+    def hash_file(path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def add_file(self, file):
+        """
+        Convert, chunk, and embed a single file, then store its vectors in Chroma,
+        replacing any vectors previously stored for it.
+        """
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        sha256 = self.hash_file(path)
+
+        # Convert file to Markdown/text
+        md_text = convert_file(path)
+
+        # Chunk it up
+        chunks = chunk_text(md_text, chunk_size=1024, overlap=100)
 
-                # Use a unique ID for each chunk
-                doc_id = f"{os.path.basename(file)}-{uuid.uuid4().hex[:8]}-{i}"
+        with self.collection_lock:
+            self.collection.delete(where={"source_file": path})
 
+        # Use a unique prefix for this ingestion, each chunk gets its index appended
+        id_prefix = f"{os.path.basename(path)}-{uuid.uuid4().hex[:8]}"
+
+        for start in range(0, len(chunks), self.embed_batch_size):
+            batch = chunks[start:start + self.embed_batch_size]
+            embeddings = self.embed(batch, prefix="search_document: ") # prefix for nomic-embed-text
+
+            indices = range(start, start + len(batch))
+            with self.collection_lock:
                 self.collection.add(
-                    documents=[chunk],
-                    metadatas=[{"source_file": file, "chunk_index": i}],
-                    ids=[doc_id],
-                    embeddings=[embedding]
+                    documents=batch,
+                    metadatas=[{"source_file": path, "chunk_index": i} for i in indices],
+                    ids=[f"{id_prefix}-{i}" for i in indices],
+                    embeddings=embeddings
                 )
 
+        with self.manifest_lock:
+            self.manifest[path] = {
+                "sha256": sha256,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "chunks": len(chunks)
+            }
+
+    def remove_files(self, files):
+        """
+        Delete the vectors and manifest entries for the given files.
+        """
+        for file in files:
+            path = os.path.abspath(file)
+            with self.collection_lock:
+                self.collection.delete(where={"source_file": path})
+            with self.manifest_lock:
+                self.manifest.pop(path, None)
+        self.save_manifest()
+
+    def remove_missing_files(self):
+        """
+        Delete the vectors for indexed files that no longer exist on disk.
+        """
+        missing = [path for path in list(self.manifest) if not os.path.exists(path)]
+        if missing:
+            self.remove_files(missing)
+        return missing
+
+    def embed(self, texts, prefix=""):
+        """
+        Embed texts with the given prefix, serving repeats from the embedding cache.
+        Only cache misses are sent to the embedding model, in a single batch.
+        """
+        embeddings = self.embedding_cache.get_many(self.embedding_model, prefix, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = embed_batch_with_ollama(
+                server_url=self.llm_server,
+                texts=[prefix + text for text in missing_texts],
+                model=self.embedding_model
+            )
+            self.embedding_cache.put_many(self.embedding_model, prefix, missing_texts, new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
     def search(self, query, n_results=3):
         """
-        Embed the query, then retrieve the most relevant chunks from the in-memory vector DB.
+        Embed the query, then retrieve the most relevant chunks from the vector DB.
         Returns a list of (chunk_text, metadata, distance).
         """
         # Embed the query
-        query_embedding = embed_with_ollama(
-            server_url=self.llm_server,
-            text="search_query: " + query, # prefix for nomic-embed-text
-            model=self.embedding_model
-        )
+        query_embedding = self.embed([query], prefix="search_query: ")[0] # prefix for nomic-embed-text
 
         # Query the Chroma collection
         results = self.collection.query(
@@ -135,6 +277,8 @@ def main():
         print(f"Source file: {meta['source_file']}, chunk index: {meta['chunk_index']}")
         print(chunk)
 
+    print(f"\nEmbedding cache: {rag_repo.embedding_cache.stats()}")
+
 
 if __name__ == "__main__":
     main()
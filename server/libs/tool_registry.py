@@ -0,0 +1,213 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import time
+import typing
+
+# Schema type names, as written in the function schemas, and the Python types they accept
+SCHEMA_TYPES = {
+    "string": str,
+    "str": str,
+    "integer": int,
+    "int": int,
+    "number": (int, float),
+    "float": (int, float),
+    "boolean": bool,
+    "bool": bool,
+    "list": list,
+    "array": list,
+    "object": dict,
+    "dict": dict
+}
+
+# How argument types are described in errors shown to agents
+TYPE_NAMES = {
+    str: "a string",
+    int: "an integer",
+    (int, float): "a number",
+    bool: "a boolean",
+    list: "a list",
+    dict: "an object"
+}
+
+
+class ToolError(Exception):
+    """A tool call that cannot be run, the message is meant for the agent that made it"""
+
+
+def _python_type(spec):
+    """The type an argument spec accepts, or None for anything"""
+    if isinstance(spec, dict):
+        spec = spec.get("type")
+    if isinstance(spec, str):
+        return SCHEMA_TYPES.get(spec.lower())
+    if isinstance(spec, type):
+        return spec
+    # Typing constructs such as List[str]
+    origin = typing.get_origin(spec)
+    return origin if isinstance(origin, type) else None
+
+def _check(name, value, expected):
+    """Return value as the expected type, raises ToolError if it is not one"""
+    if expected is None or value is None:
+        return value
+    if expected is int or expected == (int, float):
+        # Models often quote numbers
+        if isinstance(value, str):
+            try:
+                return int(value) if expected is int else float(value)
+            except ValueError:
+                pass
+        elif isinstance(value, expected) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, expected):
+        return value
+    elif expected is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+        # e.g. a section number where a section name or number is asked for
+        return str(value)
+    expected_name = TYPE_NAMES.get(expected, getattr(expected, "__name__", "value"))
+    raise ToolError(f"argument '{name}' should be {expected_name}, got {type(value).__name__}")
+
+
+class Tool:
+    def __init__(self, name, handler, arguments, read_only):
+        self.name = name
+        self.handler = handler
+        self.read_only = read_only
+        # (argument name, accepted type, required) for each argument, compiled once
+        self.arguments = [
+            (arg, _python_type(spec), not (isinstance(spec, dict) and spec.get("optional", False)))
+            for arg, spec in arguments.items()
+        ]
+
+    def validate(self, arguments):
+        """Return the arguments the handler takes, checked and converted, raises ToolError"""
+        if not isinstance(arguments, dict):
+            raise ToolError(f"arguments of {self.name} should be an object")
+        kwargs = {}
+        for arg, expected, required in self.arguments:
+            if arg not in arguments:
+                if required:
+                    raise ToolError(f"{self.name} is missing required argument '{arg}'")
+                continue
+            kwargs[arg] = _check(arg, arguments[arg], expected)
+        # Arguments the tool does not take are ignored
+        return kwargs
+
+
+class ToolRegistry:
+    """
+    Maps tool names to handlers. Arguments are checked against the tool's function schema
+    before its handler runs, and every call's latency is recorded per tool.
+
+    A handler is called as handler(context, **arguments), where context is whatever the
+    caller passes (e.g. the agent making the call). Arguments marked "optional": True in a
+    schema may be missing, so their handler parameters need a default.
+    """
+    def __init__(self, schemas=()):
+        self.schemas = {schema["name"]: schema for schema in schemas}
+        self.tools = {}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def register(self, name, handler, read_only=False, arguments=None):
+        """
+        Add a tool. Its arguments come from the schema of the same name unless given.
+        read_only tools do not change anything others can see.
+        """
+        if arguments is None:
+            if name not in self.schemas:
+                raise ValueError(f"No schema for tool {name}")
+            arguments = self.schemas[name]["arguments"]
+        self.tools[name] = Tool(name, handler, arguments, read_only)
+
+    def get(self, name):
+        return self.tools.get(name)
+
+    def is_read_only(self, name):
+        tool = self.tools.get(name)
+        return tool is not None and tool.read_only
+
+    def call(self, name, context, arguments):
+        """Run a tool, returns what its handler returns. Raises ToolError for unknown tools or bad arguments"""
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolError(f"unknown tool '{name}', available tools are: {', '.join(self.tools)}")
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = tool.handler(context, **tool.validate(arguments))
+            failed = False
+            return result
+        finally:
+            self.record(name, time.perf_counter() - start, failed)
+
+    def record(self, name, seconds, failed):
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += 1 if failed else 0
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def get_stats(self):
+        """Calls, errors and mean/max latency in milliseconds of each tool called so far"""
+        with self._stats_lock:
+            return {
+                name: {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "mean_ms": stats["total_seconds"] * 1000 / stats["calls"],
+                    "max_ms": stats["max_seconds"] * 1000
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+class ToolCallScheduler:
+    """
+    Runs the tool calls of one pass on up to max_parallel threads, as they are submitted.
+
+    Read-only calls in a row run concurrently. A call that writes waits for every call
+    submitted before it, and every call after it waits for it, so writes keep their order
+    relative to all other calls. Results come back in submission order.
+
+    Calls only ever wait on calls submitted earlier, which are ahead of them in the pool's
+    queue, so the pool must not be shared between passes.
+    """
+    def __init__(self, max_parallel=4):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="tools")
+        self.futures = []
+        # The last write, and the reads submitted since
+        self.barrier = None
+        self.reads = []
+
+    def __len__(self):
+        return len(self.futures)
+
+    def submit(self, read_only, fn, *args):
+        if read_only:
+            depends_on = [self.barrier] if self.barrier is not None else []
+        else:
+            depends_on = self.reads + ([self.barrier] if self.barrier is not None else [])
+
+        def run():
+            if depends_on:
+                wait(depends_on)
+            return fn(*args)
+
+        future = self.executor.submit(run)
+        if read_only:
+            self.reads.append(future)
+        else:
+            self.barrier = future
+            self.reads = []
+        self.futures.append(future)
+        return future
+
+    def results(self):
+        """Every call's result, in submission order, once all have finished"""
+        return [future.result() for future in self.futures]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
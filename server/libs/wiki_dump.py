@@ -0,0 +1,191 @@
+import bz2
+import os
+import re
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+# Redirects followed before giving up, they can chain
+MAX_REDIRECTS = 3
+
+
+def wikitext_to_text(wikitext):
+    """
+    Rough plain text of a page's wikitext: templates, tables, references, files and markup
+    are removed, links are replaced by their label. Section headings ("== History ==") are
+    kept, as in the text the live API returns.
+    """
+    text = re.sub(r'<!--.*?-->', '', wikitext, flags=re.DOTALL)
+    text = re.sub(r'<ref[^>/]*/>', '', text)
+    text = re.sub(r'<ref[^>]*>.*?</ref>', '', text, flags=re.DOTALL)
+
+    # Templates and tables nest, remove the innermost until none are left
+    previous = None
+    while previous != text:
+        previous = text
+        text = re.sub(r'\{\{[^{}]*\}\}', '', text)
+        text = re.sub(r'\{\|(?:(?!\{\|).)*?\|\}', '', text, flags=re.DOTALL)
+
+    # Files, images and categories, whose captions can hold links of their own
+    text = re.sub(r'\[\[(?:File|Image|Category):(?:[^\[\]]|\[\[[^\[\]]*\]\])*\]\]', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]', r'\1', text)
+    text = re.sub(r'\[https?://[^\s\]]+\s*([^\]]*)\]', r'\1', text)
+    text = re.sub(r"'{2,}", '', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+def normalize_title(title):
+    """MediaWiki title form: spaces for underscores, first letter upper case"""
+    title = title.replace('_', ' ').strip()
+    return title[:1].upper() + title[1:]
+
+
+class WikiDump:
+    """
+    Serves pages from a local Wikipedia multistream dump, without network access.
+
+    A multistream dump (pages-articles-multistream.xml.bz2) is a series of bz2 streams of
+    about 100 pages each, and its index file (pages-articles-multistream-index.txt.bz2) lists
+    "offset:page_id:title" for every page. The index is loaded once into a SQLite title index
+    next to the dump, after which fetching a page decompresses just the stream that holds it.
+    The title index records which dump it was built from and whether loading finished, and is
+    rebuilt if loading was interrupted or the dump has changed since.
+    """
+    def __init__(self, dump_path, index_path=None, db_path=None, cached_streams=8):
+        self.dump_path = dump_path
+        self.index_path = index_path if index_path else re.sub(r'\.xml\.bz2$', '-index.txt.bz2', dump_path)
+        self.db_path = db_path if db_path else dump_path + '.titles.db'
+        self.cached_streams = cached_streams
+
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS titles (
+                title TEXT PRIMARY KEY,
+                offset INTEGER,
+                page_id INTEGER
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                dump_path TEXT,
+                dump_size INTEGER,
+                dump_mtime REAL,
+                complete INTEGER
+            )
+        ''')
+        self._conn.commit()
+        if not self.index_complete():
+            self.build_index()
+
+    def dump_stat(self):
+        """(path, size, mtime) identifying the dump file"""
+        stat = os.stat(self.dump_path)
+        return os.path.abspath(self.dump_path), stat.st_size, stat.st_mtime
+
+    def index_complete(self):
+        """Whether the title index was fully loaded from the current dump"""
+        row = self._conn.execute('SELECT dump_path, dump_size, dump_mtime, complete FROM meta WHERE id = 1').fetchone()
+        return row is not None and row[3] == 1 and tuple(row[:3]) == self.dump_stat()
+
+    def build_index(self):
+        """Load the dump's index file into the title index, replacing whatever it held"""
+        print(f"Building title index for {self.dump_path}")
+        opener = bz2.open if self.index_path.endswith('.bz2') else open
+        with self._lock, opener(self.index_path, 'rt', encoding='utf-8') as f:
+            # Marked incomplete until the last row is in, so an interrupted load is started over
+            self._conn.execute('INSERT OR REPLACE INTO meta VALUES (1, ?, ?, ?, 0)', self.dump_stat())
+            self._conn.execute('DELETE FROM titles')
+            self._conn.commit()
+
+            rows = []
+            for line in f:
+                # Titles can contain colons, offsets and ids cannot
+                offset, page_id, title = line.rstrip('\n').split(':', 2)
+                rows.append((title, int(offset), int(page_id)))
+                if len(rows) >= 100000:
+                    self._conn.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?)', rows)
+                    self._conn.commit()
+                    rows = []
+            self._conn.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?)', rows)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_titles_nocase ON titles(title COLLATE NOCASE)')
+            self._conn.execute('UPDATE meta SET complete = 1 WHERE id = 1')
+            self._conn.commit()
+
+    def get_page(self, title):
+        """The page as a dict with title, text and url, following redirects. None if it is not in the dump"""
+        for _ in range(MAX_REDIRECTS + 1):
+            found = self.find_title(title)
+            if found is None:
+                return None
+            title, offset = found
+
+            page = self.read_page(offset, title)
+            if page is None:
+                return None
+            redirect = page.find('redirect')
+            if redirect is not None:
+                title = redirect.get('title')
+                continue
+
+            text = page.findtext('revision/text') or ''
+            return {
+                'title': title,
+                'text': wikitext_to_text(text),
+                'url': f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+            }
+        return None
+
+    def find_title(self, title):
+        """(title as in the dump, stream offset) for a title, matching case-insensitively if need be"""
+        title = normalize_title(title)
+        with self._lock:
+            row = self._conn.execute('SELECT title, offset FROM titles WHERE title = ?', (title,)).fetchone()
+            if row is None:
+                row = self._conn.execute('SELECT title, offset FROM titles WHERE title = ? COLLATE NOCASE LIMIT 1', (title,)).fetchone()
+        return row
+
+    def read_page(self, offset, title):
+        for page in self.read_stream(offset):
+            if page.findtext('title') == title:
+                return page
+        return None
+
+    def read_stream(self, offset):
+        """The page elements of the bz2 stream starting at offset"""
+        with self._lock:
+            pages = self._streams.get(offset)
+            if pages is not None:
+                self._streams.move_to_end(offset)
+                return pages
+
+        decompressor = bz2.BZ2Decompressor()
+        parts = []
+        with open(self.dump_path, 'rb') as f:
+            f.seek(offset)
+            while not decompressor.eof:
+                chunk = f.read(256 * 1024)
+                if not chunk:
+                    break
+                parts.append(decompressor.decompress(chunk))
+
+        # A stream is a run of <page> elements without a root, drop the siteinfo and root tags around them
+        xml = b''.join(parts).decode('utf-8')
+        start = xml.find('<page>')
+        xml = xml[start:] if start != -1 else ''
+        xml = re.sub(r'</mediawiki>\s*$', '', xml)
+        pages = ET.fromstring(f"<pages>{xml}</pages>").findall('page')
+
+        with self._lock:
+            self._streams[offset] = pages
+            while len(self._streams) > self.cached_streams:
+                self._streams.popitem(last=False)
+        return pages
+
+    def close(self):
+        self._conn.close()
@@ -1,6 +1,16 @@
 import json
+import os
+import re
+import threading
 import wikipedia
 import bs4
+try:
+    from libs.page_cache import get_shared_page_cache
+    from libs.wiki_dump import WikiDump
+except ImportError:
+    # Run as a script from inside libs, like its siblings
+    from page_cache import get_shared_page_cache
+    from wiki_dump import WikiDump
 
 ########################
 # Monkey patch section #
@@ -20,7 +30,87 @@ def _monkey_patched_init(self, markup="", *args, **kwargs):
 bs4.BeautifulSoup.__init__ = _monkey_patched_init
 
 
+# Set once for the process, not on every fetch
+wikipedia.set_user_agent("WikipediaResearchScript/1.0")
+wikipedia.set_lang("en")
+
+# Serve pages from this multistream dump instead of the live API, and never fall back to the API when offline
+WIKI_DUMP_PATH = os.environ.get('POLIS_WIKI_DUMP', '')
+WIKI_OFFLINE = os.environ.get('POLIS_WIKI_OFFLINE', '') not in ('', '0')
+
+# Characters of a page returned when no length is asked for, and the most returned at once
+DEFAULT_LENGTH = 4000
+MAX_LENGTH = 20000
+# In-page search results returned, and characters of context around each
+MAX_SEARCH_RESULTS = 8
+SNIPPET_CHARS = 300
+
+# "== History ==" style headings, as in both the live API's text and the dump's
+HEADING = re.compile(r'^(={2,6})\s*(.+?)\s*\1\s*$', re.MULTILINE)
+
+def index_sections(text):
+    """
+    The sections of a page's text as dicts with number, title, level, start and end offsets.
+    Section 0 is the introduction before the first heading.
+    """
+    sections = [{"number": 0, "title": "Introduction", "level": 1, "start": 0}]
+    for match in HEADING.finditer(text):
+        sections.append({"number": len(sections), "title": match.group(2), "level": len(match.group(1)), "start": match.start()})
+    for section, following in zip(sections, sections[1:] + [None]):
+        section["end"] = following["start"] if following is not None else len(text)
+    return sections
+
+def table_of_contents(sections):
+    """One line per section: number, title indented by level, and length"""
+    return [f"{section['number']}. {'  ' * max(section['level'] - 2, 0)}{section['title']} ({section['end'] - section['start']} chars)" for section in sections]
+
+def find_section(sections, section):
+    """A section by number or (case-insensitive) title, or None"""
+    section = str(section).strip()
+    if section.isdigit():
+        number = int(section)
+        return sections[number] if number < len(sections) else None
+    for candidate in sections:
+        if candidate["title"].lower() == section.lower():
+            return candidate
+    for candidate in sections:
+        if section.lower() in candidate["title"].lower():
+            return candidate
+    return None
+
+def section_at(sections, offset):
+    for section in reversed(sections):
+        if section["start"] <= offset:
+            return section
+    return sections[0]
+
+
+_shared_dump = None
+_shared_dump_lock = threading.Lock()
+
+def get_shared_dump():
+    """Get the process-wide dump at POLIS_WIKI_DUMP, or None if no dump is configured"""
+    global _shared_dump
+    if not WIKI_DUMP_PATH:
+        return None
+    with _shared_dump_lock:
+        if _shared_dump is None:
+            _shared_dump = WikiDump(WIKI_DUMP_PATH)
+        return _shared_dump
+
+
 class WikiSearch:
+    """
+    Wikipedia pages for agents. Pages come from the local dump if one is configured, otherwise
+    (or when the dump lacks them, unless offline) from the live API, and are kept in the
+    shared page cache either way.
+    """
+    def __init__(self, cache=None, dump=None, offline=None):
+        # The shared cache and dump are opened on first use, so creating a WikiSearch is free
+        self.cache = cache
+        self.dump = dump
+        self.offline = offline if offline is not None else WIKI_OFFLINE
+
     def get_function_schemas(self):
         """
         returns list of function schemas
@@ -31,23 +121,152 @@ class WikiSearch:
                 "title": {
                     "type": "string",
                     "description": "Title of the Wikipedia page to retrieve"
+                },
+                "section": {
+                    "type": "string",
+                    "description": "Number or title of the section to read, from the table of contents (optional, the page from the start if not given)",
+                    "optional": True
+                },
+                "start": {
+                    "type": "integer",
+                    "description": "Character offset to read from, within the section if one is given. Use next_start from the previous result to read on (optional)",
+                    "optional": True
+                },
+                "length": {
+                    "type": "integer",
+                    "description": f"Number of characters to read, at most {MAX_LENGTH} (optional, default {DEFAULT_LENGTH})",
+                    "optional": True
                 }
             },
-            "description": "Fetches Wikipedia text, title, and url",
+            "description": "Fetches part of a Wikipedia page: its title, url, table of contents and the text of a section or character range",
+        },{
+            "name": "search_wikipedia_page",
+            "arguments": {
+                "title": {
+                    "type": "string",
+                    "description": "Title of the Wikipedia page to search"
+                },
+                "query": {
+                    "type": "string",
+                    "description": "Words or phrase to look for in the page"
+                }
+            },
+            "description": "Finds where a Wikipedia page mentions something, returns matching snippets with their section and character offset",
         }]
 
-    def get_wikipedia_text(self, title):
-        # Set user agent and language (optional but recommended)
-        wikipedia.set_user_agent("WikipediaResearchScript/1.0")
-        wikipedia.set_lang("en")
-        
-        try:
-            page = wikipedia.page(title, auto_suggest=False)
-            return json.dumps({
-                'title': page.title,
-                'text': page.content,
-                'url': page.url
+    def get_page(self, title):
+        """
+        The page as a dict with title, text and url, or None if there is no such page available.
+        Raises the wikipedia library's exceptions for live lookups that fail.
+        """
+        title = title.strip()
+        cache = self.cache if self.cache is not None else get_shared_page_cache()
+        dump = self.dump if self.dump is not None else get_shared_dump()
+
+        if dump is not None:
+            key = f"dump:{title}"
+            page = cache.get(key)
+            if page is None:
+                page = dump.get_page(title)
+                if page is not None:
+                    cache.put(key, page)
+            if page is not None:
+                return page
+        if self.offline:
+            return None
+
+        key = f"live:en:{title}"
+        page = cache.get(key)
+        if page is None:
+            wiki_page = wikipedia.page(title, auto_suggest=False)
+            page = {
+                'title': wiki_page.title,
+                'text': wiki_page.content,
+                'url': wiki_page.url
+            }
+            cache.put(key, page)
+        return page
+
+    def get_wikipedia_text(self, title, section=None, start=None, length=None):
+        """A slice of a page with the page's table of contents, as JSON, or an error message"""
+        page = self.fetch(title)
+        if isinstance(page, str):
+            return page
+
+        text = page['text']
+        sections = index_sections(text)
+        begin, end = 0, len(text)
+        if section is not None:
+            found = find_section(sections, section)
+            if found is None:
+                return f"Error: No section '{section}' in '{page['title']}'. Sections: {table_of_contents(sections)}"
+            begin, end = found['start'], found['end']
+
+        length = min(max(length, 1), MAX_LENGTH) if length is not None else DEFAULT_LENGTH
+        slice_start = min(begin + max(start or 0, 0), end)
+        slice_end = min(slice_start + length, end)
+        return json.dumps({
+            'title': page['title'],
+            'url': page['url'],
+            'table_of_contents': table_of_contents(sections),
+            'section': section_at(sections, slice_start)['title'],
+            'start': slice_start - begin,
+            'text': text[slice_start:slice_end],
+            # Where to continue reading, relative to the section if one was asked for
+            'next_start': slice_end - begin if slice_end < end else None
+        })
+
+    def search_wikipedia_page(self, title, query):
+        """Snippets of a page around a phrase, or around the paragraphs mentioning most of its words, as JSON"""
+        page = self.fetch(title)
+        if isinstance(page, str):
+            return page
+
+        text = page['text']
+        sections = index_sections(text)
+        lowered = text.lower()
+        phrase = query.strip().lower()
+
+        offsets = []
+        position = lowered.find(phrase) if phrase else -1
+        while position != -1 and len(offsets) < MAX_SEARCH_RESULTS:
+            offsets.append(position)
+            position = lowered.find(phrase, position + len(phrase))
+
+        if not offsets:
+            # No exact phrase, rank paragraphs by how many of the query's words they contain
+            words = set(re.findall(r'\w+', phrase))
+            scored = []
+            for match in re.finditer(r'[^\n]+', lowered):
+                score = sum(1 for word in words if word in match.group(0))
+                if score:
+                    scored.append((-score, match.start()))
+            offsets = [offset for _, offset in sorted(scored)[:MAX_SEARCH_RESULTS]]
+
+        results = []
+        for offset in offsets:
+            snippet_start = max(offset - SNIPPET_CHARS // 2, 0)
+            section = section_at(sections, offset)
+            results.append({
+                'section': section['title'],
+                'section_number': section['number'],
+                'start': offset - section['start'],
+                'snippet': text[snippet_start:snippet_start + SNIPPET_CHARS]
             })
+        return json.dumps({
+            'title': page['title'],
+            'url': page['url'],
+            'query': query,
+            'results': results
+        })
+
+    def fetch(self, title):
+        """get_page, with failures as an error message for the agent"""
+        try:
+            page = self.get_page(title)
+            if page is None:
+                return f"Error: Could not find Wikipedia page with title '{title}'"
+            return page
         except wikipedia.PageError:
             # Page does not exist
             return f"Error: Could not find Wikipedia page with title '{title}'"
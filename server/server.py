@@ -1,12 +1,17 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, make_response, Response
 from datetime import datetime
+import json
 import os
 import uuid
 from werkzeug.utils import secure_filename
 
 # Import UIInterface and database functions
 from ui_interface import UIInterface
-from database import get_forum_threads, get_chat_messages, get_agents, save_forum_thread, save_forum_reply, save_chat_message
+from database import (
+    get_forum_threads, get_forum_thread, get_chat_messages, get_agents, save_forum_thread, save_forum_reply, save_chat_message,
+    get_data_cursor, get_updates, read_snapshot, add_change_listener
+)
+from change_feed import ChangeFeed
 
 app = Flask(__name__, 
            static_folder='../web',  # Path to static files
@@ -30,7 +35,28 @@ def get_file_size(filepath):
     except:
         return 0
 
-def get_initial_data():
+def get_artifacts_version():
+    # The uploads folder's mtime changes whenever a file is added or removed
+    try:
+        return os.stat(UPLOAD_FOLDER).st_mtime_ns
+    except OSError:
+        return 0
+
+def encode_cursor(cursor, artifacts_version):
+    return f"{cursor['chat']}.{cursor['thread']}.{cursor['reply']}.{cursor['agent']}.{artifacts_version}"
+
+def decode_cursor(value):
+    """Parse a client cursor, returns None if it is malformed"""
+    try:
+        chat, thread, reply, agent, artifacts = (int(part) for part in value.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return {"chat": chat, "thread": thread, "reply": reply, "agent": agent, "artifacts": artifacts}
+
+def get_current_cursor():
+    return encode_cursor(get_data_cursor(), get_artifacts_version())
+
+def get_artifacts():
     # Get list of files from uploads directory
     artifacts = []
     if os.path.exists(UPLOAD_FOLDER):
@@ -45,13 +71,41 @@ def get_initial_data():
                         os.path.getctime(filepath)
                     ).strftime('%Y-%m-%d %H:%M:%S')
                 })
-    
-    return {
-        "artifacts": artifacts,
-        "forum": get_forum_threads(),
-        "chat": get_chat_messages(),
-        "agents": get_agents()
+    return artifacts
+
+# Chat messages in a full snapshot, older ones are paged in through /api/chat/history
+CHAT_WINDOW = 200
+# Newest threads in a full snapshot, older ones are paged in through /api/forum/history
+FORUM_WINDOW = 50
+
+def get_initial_data():
+    artifacts_version = get_artifacts_version()
+    with read_snapshot():
+        return {
+            "cursor": encode_cursor(get_data_cursor(), artifacts_version),
+            "artifacts": get_artifacts(),
+            "forum": get_forum_threads(FORUM_WINDOW),
+            "chat": get_chat_messages(CHAT_WINDOW),
+            "agents": get_agents()
+        }
+
+def get_delta_data(since):
+    """
+    Get only what changed after the since cursor: new chat messages, threads and replies,
+    agents whose rows changed (including agents that left), and artifacts if any were added or removed.
+    """
+    artifacts_version = get_artifacts_version()
+    updates = get_updates(since)
+    delta = {
+        "cursor": encode_cursor(updates["cursor"], artifacts_version),
+        "chat": updates["chat"],
+        "threads": updates["threads"],
+        "replies": updates["replies"],
+        "agents": updates["agents"]
     }
+    if artifacts_version != since["artifacts"]:
+        delta["artifacts"] = get_artifacts()
+    return delta
 
 # Routes
 @app.route('/')
@@ -60,7 +114,59 @@ def serve_index():
 
 @app.route('/api/data')
 def get_data():
-    return jsonify(get_initial_data())
+    """
+    Full snapshot, or with ?since=<cursor> only the changes after that cursor.
+    The current cursor doubles as the ETag, so an unchanged polis answers 304 without reading any rows.
+    """
+    etag = get_current_cursor()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    since = decode_cursor(request.args.get('since'))
+    if request.args.get('since') is not None and since is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    data = get_delta_data(since) if since is not None else get_initial_data()
+    response = jsonify(data)
+    response.set_etag(data["cursor"])
+    return response
+
+# Pushes every change to subscribed /api/stream clients, writes made by this process wake it immediately
+change_feed = ChangeFeed(get_current_cursor, lambda cursor: get_delta_data(decode_cursor(cursor)))
+add_change_listener(change_feed.notify)
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = 15
+
+@app.route('/api/stream')
+def stream():
+    """
+    Server-sent events feed. Each 'update' event carries the same delta as /api/data?since=,
+    a 'resync' event means the client fell behind its backlog and should refetch /api/data.
+    Pass ?since=<cursor> to first receive everything after the client's last snapshot.
+    """
+    since = decode_cursor(request.args.get('since'))
+    subscription = change_feed.subscribe()
+
+    def generate():
+        try:
+            if since is not None:
+                yield f"event: update\ndata: {json.dumps(get_delta_data(since))}\n\n"
+            while True:
+                events = subscription.get(timeout=STREAM_KEEPALIVE)
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event, data in events:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/forum/thread', methods=['POST'])
 def create_thread():
@@ -103,7 +209,7 @@ def create_thread():
 
         return jsonify({
             'status': 'success',
-            'threads': get_forum_threads()
+            'threads': get_forum_threads(FORUM_WINDOW)
         })
 
     except Exception as e:
@@ -122,11 +228,30 @@ def create_reply():
         # Save reply to database
         save_forum_reply(thread_id, reply)
         
-        return jsonify({"threads": get_forum_threads()})
+        return jsonify({"threads": get_forum_threads(FORUM_WINDOW)})
     except Exception as e:
         print(f"Error creating reply: {str(e)}")
         return jsonify({'error': 'Failed to create reply'}), 500
 
+@app.route('/api/forum/thread/<thread_id>')
+def get_thread(thread_id):
+    """One thread with all its replies, for threads outside the loaded window"""
+    thread = get_forum_thread(thread_id)
+    if thread is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    return jsonify({"thread": thread})
+
+@app.route('/api/forum/history')
+def forum_history():
+    """Page back through the forum: the limit threads created before ?before=<seq>, newest first"""
+    try:
+        before_seq = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', FORUM_WINDOW, type=int), FORUM_WINDOW)
+        return jsonify({"forum": get_forum_threads(limit, before_seq=before_seq)})
+    except Exception as e:
+        print(f"Error getting forum history: {str(e)}")
+        return jsonify({'error': 'Failed to get forum history'}), 500
+
 @app.route('/api/chat', methods=['POST'])
 def send_message():
     try:
@@ -135,20 +260,25 @@ def send_message():
         # Add properly formatted timestamp to message
         message['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Save message to database
+        # Save message to database, subscribers receive it through the change feed
         save_chat_message(message)
         
-        # Return all updated data
-        return jsonify({
-            "success": True,
-            "chat": get_chat_messages(),
-            "forum": get_forum_threads(),
-            "agents": get_agents()
-        })
+        return jsonify({"success": True})
     except Exception as e:
         print(f"Error sending message: {str(e)}")
         return jsonify({'error': 'Failed to send message'}), 500
 
+@app.route('/api/chat/history')
+def chat_history():
+    """Page back through chat: the limit messages before ?before=<message_id>, oldest first"""
+    try:
+        before_id = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', CHAT_WINDOW, type=int), CHAT_WINDOW)
+        return jsonify({"chat": get_chat_messages(limit, before_id=before_id)})
+    except Exception as e:
+        print(f"Error getting chat history: {str(e)}")
+        return jsonify({'error': 'Failed to get chat history'}), 500
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
@@ -0,0 +1,253 @@
+import hashlib
+import multiprocessing
+import queue
+import time
+import uuid
+from typing import List, Optional
+
+from agent_orchestrator import AgentOrchestrator, initial_agent
+from agent_state import AgentStateStore
+from database import get_agent
+
+
+def agent_id_for(private_key: str) -> str:
+    """The agent id UIInterface derives from a private key"""
+    return hashlib.sha256(private_key.encode()).hexdigest()
+
+def shard_for(agent_id: str, shards: int) -> int:
+    """Stable shard for an agent id, the same in every process and run"""
+    return int(agent_id[:16], 16) % shards
+
+
+class ShardOrchestrator(AgentOrchestrator):
+    """
+    An orchestrator running one shard of the polis in a worker process.
+
+    The supervisor sends it agents to run through its inbox. create_agent tool calls are
+    forwarded to the supervisor, which places the new agent on the least loaded shard, and
+    agents that stop running are reported so they are not restarted after a crash.
+    """
+    def __init__(self, shard: int, inbox, events, server_url: str, model: str, max_in_flight: int = 4, max_workers: Optional[int] = None, state_store: Optional[AgentStateStore] = None, stream_tool_calls: bool = False):
+        super().__init__(server_url, model, max_in_flight, max_workers, state_store, stream_tool_calls=stream_tool_calls)
+        self.shard = shard
+        self.inbox = inbox
+        self.events = events
+        self.reported_stopped = set()
+
+    def run_tick(self) -> int:
+        self.handle_commands()
+        if not self.running:
+            return 0
+        scheduled = super().run_tick()
+        self.report_stopped()
+        return scheduled
+
+    def handle_commands(self):
+        while True:
+            try:
+                command = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+
+            if command[0] == "add_agent":
+                self.add_agent(command[1])
+            elif command[0] == "stop":
+                self.stop()
+
+    def add_agent(self, spec: dict):
+        """
+        Start running an agent placed on this shard. An agent that ran before is restored
+        from its last snapshot, or failing that keeps its current name and persona.
+        """
+        agent_id = agent_id_for(spec["private_key"])
+        state = self.state_store.load(agent_id) if self.state_store is not None else None
+        if state is not None:
+            self.restore_agent(state)
+            return
+
+        existing = get_agent(agent_id)
+        if existing is not None:
+            self.create_agent(existing["name"], spec["initial_instructions"], spec["initial_notes"], spec["private_key"], existing["persona"])
+        else:
+            self.create_agent(spec["name"], spec["initial_instructions"], spec["initial_notes"], spec["private_key"])
+
+    def spawn_agent(self, name: str, initial_instructions: str, initial_notes: List[str]):
+        self.events.put(("create_agent", self.shard, name, initial_instructions, initial_notes))
+
+    def report_stopped(self):
+        with self.agents_lock:
+            stopped = [agent.ui.agent_id for agent in self.agents if not agent.is_running]
+        for agent_id in stopped:
+            if agent_id not in self.reported_stopped:
+                self.reported_stopped.add(agent_id)
+                self.events.put(("agent_stopped", self.shard, agent_id))
+
+
+def run_shard(shard: int, specs: List[dict], inbox, events, server_url: str, model: str, max_in_flight: int, stream_tool_calls: bool):
+    """Worker process entry point, runs the given agents until told to stop"""
+    orchestrator = ShardOrchestrator(shard, inbox, events, server_url, model, max_in_flight, state_store=AgentStateStore(), stream_tool_calls=stream_tool_calls)
+    for spec in specs:
+        orchestrator.add_agent(spec)
+    try:
+        orchestrator.start(0)
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardSupervisor:
+    """
+    Spreads a polis's agents over several worker processes, each running its own scheduling loop.
+
+    Agents start on the shard their id hashes to, agents created by other agents go to the
+    shard running the fewest. The supervisor keeps every shard's agent list, so when a worker
+    dies only that shard is restarted, with only its own agents, each restored from the
+    snapshot the worker last saved.
+    """
+    def __init__(self, server_url: str, model: str, shards: int, max_in_flight: int = 4, restart_delay: float = 1.0, max_restart_delay: float = 60.0, stream_tool_calls: bool = False):
+        self.server_url = server_url
+        self.model = model
+        self.shards = shards
+        self.max_in_flight = max_in_flight
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stream_tool_calls = stream_tool_calls
+
+        # Spawned workers do not inherit this process's threads, locks or connections
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.shard_agents = [{} for _ in range(shards)]
+        self.processes = [None] * shards
+        self.inboxes = [None] * shards
+        self.started_at = [0.0] * shards
+        self.restart_at = [None] * shards
+        self.crashes = [0] * shards
+        self.running = False
+
+    def start(self, agent_count: int, resume: bool = False):
+        self.running = True
+        specs = []
+        if resume:
+            # Workers restore each agent from its snapshot, the supervisor only needs its key
+            specs = [{
+                "name": state["name"],
+                "private_key": state["private_key"],
+                "initial_instructions": "",
+                "initial_notes": []
+            } for state in AgentStateStore().load_all()]
+            if specs:
+                print(f"Resuming {len(specs)} agents")
+        if not specs:
+            specs = [self.new_spec(*initial_agent(i)) for i in range(agent_count)]
+
+        for spec in specs:
+            agent_id = agent_id_for(spec["private_key"])
+            self.shard_agents[shard_for(agent_id, self.shards)][agent_id] = spec
+
+        try:
+            for shard in range(self.shards):
+                self.start_shard(shard)
+            while self.running:
+                self.handle_events(timeout=0.5)
+                self.check_shards()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.running = False
+
+    def new_spec(self, name: str, initial_instructions: str, initial_notes: List[str]) -> dict:
+        return {
+            "name": name,
+            "private_key": str(uuid.uuid4()),
+            "initial_instructions": initial_instructions,
+            "initial_notes": initial_notes
+        }
+
+    def loads(self) -> List[int]:
+        """Number of running agents placed on each shard"""
+        return [len(agents) for agents in self.shard_agents]
+
+    def start_shard(self, shard: int):
+        self.inboxes[shard] = self.context.Queue()
+        process = self.context.Process(
+            target=run_shard,
+            args=(shard, list(self.shard_agents[shard].values()), self.inboxes[shard], self.events,
+                  self.server_url, self.model, self.max_in_flight, self.stream_tool_calls),
+            name=f"polis-shard-{shard}",
+            daemon=True
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = time.monotonic()
+        self.restart_at[shard] = None
+        print(f"Started shard {shard} (pid {process.pid}) with {len(self.shard_agents[shard])} agents")
+
+    def place_agent(self, name: str, initial_instructions: str, initial_notes: List[str]) -> int:
+        """Place a new agent on the least loaded shard. Returns the shard"""
+        spec = self.new_spec(name, initial_instructions, initial_notes)
+        loads = self.loads()
+        shard = loads.index(min(loads))
+        self.shard_agents[shard][agent_id_for(spec["private_key"])] = spec
+        # A shard that is down picks the agent up from shard_agents when it restarts
+        if self.processes[shard] is not None and self.processes[shard].is_alive():
+            self.inboxes[shard].put(("add_agent", spec))
+        return shard
+
+    def handle_events(self, timeout: float):
+        try:
+            event = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while True:
+            if event[0] == "create_agent":
+                _, from_shard, name, initial_instructions, initial_notes = event
+                shard = self.place_agent(name, initial_instructions, initial_notes)
+                print(f"Agent on shard {from_shard} created {name}, placed on shard {shard}")
+            elif event[0] == "agent_stopped":
+                _, shard, agent_id = event
+                self.shard_agents[shard].pop(agent_id, None)
+
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+    def check_shards(self):
+        """Restart shards whose worker died, backing off if one keeps crashing"""
+        now = time.monotonic()
+        for shard, process in enumerate(self.processes):
+            if process is None or process.is_alive():
+                continue
+
+            # A shard that ran for a while before dying starts its backoff over
+            if now - self.started_at[shard] > self.max_restart_delay:
+                self.crashes[shard] = 0
+            self.crashes[shard] += 1
+            delay = min(self.restart_delay * 2 ** (self.crashes[shard] - 1), self.max_restart_delay)
+            print(f"Shard {shard} exited with code {process.exitcode}, restarting its {len(self.shard_agents[shard])} agents in {delay:.0f}s")
+            process.join()
+            self.processes[shard] = None
+            self.restart_at[shard] = now + delay
+
+        for shard, restart_at in enumerate(self.restart_at):
+            if restart_at is not None and self.running and now >= restart_at:
+                self.start_shard(shard)
+
+    def shutdown(self, timeout: float = 30.0):
+        """Ask every worker to stop after its in-flight passes, then wait for them"""
+        self.running = False
+        for shard, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                self.inboxes[shard].put(("stop",))
+
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
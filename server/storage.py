@@ -0,0 +1,864 @@
+import sqlite3
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Forum authors are stored as '[Agent]<agent_id>' and shown with the agent's current name
+AGENT_NAMES = '(SELECT agent_id, MAX(name) AS name FROM agents GROUP BY agent_id)'
+
+# {seq} is the backend's thread sequence column, the order threads were created in
+THREAD_SELECT = '''
+    SELECT t.{seq} AS seq, t.thread_id,
+           CASE
+               WHEN t.op_author LIKE '[Agent]%' THEN COALESCE('[Agent] ' || a.name, t.op_author)
+               ELSE t.op_author
+           END AS op_author,
+           t.op_content, t.op_timestamp, t.op_attachment
+    FROM forum_threads t
+    LEFT JOIN ''' + AGENT_NAMES + ''' a
+           ON t.op_author LIKE '[Agent]%' AND a.agent_id = SUBSTR(t.op_author, 8)
+'''
+
+REPLY_SELECT = '''
+    SELECT r.reply_id, r.thread_id,
+           CASE
+               WHEN r.author LIKE '[Agent]%' THEN COALESCE('[Agent] ' || a.name, r.author)
+               ELSE r.author
+           END AS author,
+           r.content, r.timestamp, r.attachment
+    FROM forum_replies r
+    LEFT JOIN ''' + AGENT_NAMES + ''' a
+           ON r.author LIKE '[Agent]%' AND a.agent_id = SUBSTR(r.author, 8)
+'''
+
+# Agent dict keys that can be updated in place, mapped to their columns.
+# left is a keyword in PostgreSQL so it is always quoted
+AGENT_COLUMNS = {
+    'name': 'name',
+    'persona': 'persona',
+    'thoughts': 'thoughts',
+    'activity': 'activity',
+    'latestActivity': 'latest_activity',
+    'left': '"left"',
+    'joinedAt': 'joined_at',
+    'leftTimestamp': 'left_timestamp'
+}
+AGENT_JSON_COLUMNS = {'thoughts', 'activity'}
+
+# Columns are listed so bookkeeping columns a backend adds stay out of the UI dicts
+CHAT_SELECT = 'SELECT message_id, sender, message, timestamp FROM chat_messages'
+AGENT_SELECT = '''
+    SELECT agent_id, name, persona, thoughts, activity, latest_activity, "left",
+           joined_at, left_timestamp, version
+    FROM agents
+'''
+
+
+def dict_factory(cursor, row):
+    """Convert database rows to dictionaries"""
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+def thread_from_row(thread, replies):
+    """Convert a forum_threads row and its replies into the thread dict used by the UI"""
+    # Convert attachment JSON strings back to dictionaries
+    if thread['op_attachment']:
+        thread['op_attachment'] = json.loads(thread['op_attachment'])
+
+    # Restructure thread to match original format
+    thread['threadId'] = thread['thread_id']
+    thread['op'] = {
+        'author': thread['op_author'],
+        'content': thread['op_content'],
+        'timestamp': thread['op_timestamp'],
+    }
+    if thread['op_attachment']:
+        thread['op']['attachment'] = thread['op_attachment']
+
+    thread['replies'] = replies
+
+    # Clean up raw database fields
+    del thread['thread_id']
+    del thread['op_author']
+    del thread['op_content']
+    del thread['op_timestamp']
+    del thread['op_attachment']
+    return thread
+
+def agent_from_row(agent):
+    """Convert an agents row into the agent dict used by the UI"""
+    # Convert JSON strings back to lists
+    agent['thoughts'] = json.loads(agent['thoughts']) if agent['thoughts'] else []
+    agent['activity'] = json.loads(agent['activity']) if agent['activity'] else []
+    agent['id'] = agent['agent_id']
+    agent['joinedAt'] = agent['joined_at']
+    agent['leftTimestamp'] = agent['left_timestamp']
+    agent['latestActivity'] = agent['latest_activity']
+
+    # Clean up raw database fields
+    del agent['agent_id']
+    del agent['joined_at']
+    del agent['left_timestamp']
+    del agent['latest_activity']
+    return agent
+
+
+class Storage(ABC):
+    """
+    Where the polis keeps its forum threads, replies, chat messages and agents.
+
+    The queries are shared by every backend and written in the SQL both SQLite and
+    PostgreSQL accept, with '?' placeholders. A backend implements the abstract methods,
+    which open connections and run transactions, and supplies the few dialect differences:
+        seq_column      column giving the order threads were created in
+        next_version    SQL expression for the next agent version
+        no_limit        LIMIT value meaning no limit
+        lock_rows       suffix that locks rows read for a read-modify-write
+    Each thread gets its own connection, reopened after a fork.
+    """
+    seq_column = None
+    next_version = None
+    no_limit = None
+    lock_rows = ''
+
+    def __init__(self):
+        self._local = threading.local()
+        self.thread_select = THREAD_SELECT.format(seq=self.seq_column)
+
+    # Backend hooks
+
+    @abstractmethod
+    def connect(self):
+        """Open a new connection that returns rows as dicts"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_tables(self, conn):
+        raise NotImplementedError
+
+    @contextmanager
+    @abstractmethod
+    def transaction(self):
+        """Commit everything in the block at once, or roll it all back on error"""
+        raise NotImplementedError
+
+    @contextmanager
+    @abstractmethod
+    def write_transaction(self):
+        """A transaction for read-modify-write, reads are locked against concurrent writers"""
+        raise NotImplementedError
+
+    @contextmanager
+    @abstractmethod
+    def read_snapshot(self):
+        """Run several reads against one consistent snapshot of the database"""
+        raise NotImplementedError
+
+    def sql(self, query):
+        """Translate a query written with '?' placeholders to the driver's paramstyle"""
+        return query
+
+    @abstractmethod
+    def rename_rows(self, agent_id, name):
+        """Rename every row of an agent, collapsing them into one. Returns the row count"""
+        raise NotImplementedError
+
+    # Connections
+
+    def get_connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # A forked process must not share its parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = self.connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Close this thread's connection, if it has one"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def execute(self, query, params=()):
+        return self.get_connection().execute(self.sql(query), params)
+
+    def init_db(self):
+        """Create the tables and indexes if they do not exist"""
+        with self.transaction() as conn:
+            self.create_tables(conn)
+
+    # Forum
+
+    def save_forum_thread(self, thread_data):
+        """Save a forum thread to the database"""
+        with self.transaction():
+            self.execute('''
+                INSERT INTO forum_threads (thread_id, op_author, op_content, op_timestamp, op_attachment)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                thread_data['threadId'],
+                thread_data['op']['author'],
+                thread_data['op']['content'],
+                thread_data['op']['timestamp'],
+                json.dumps(thread_data['op'].get('attachment')) if thread_data['op'].get('attachment') else None
+            ))
+
+    def get_forum_threads(self, limit=None, offset=0, after_seq=None, before_seq=None):
+        """
+        Get forum threads with their replies, newest thread first, optionally one page at a time.
+        If after_seq is given, only threads created after that sequence number are returned,
+        and if before_seq is given only those created before it (paging back).
+        """
+        seq = self.seq_column
+        filters = []
+        page_args = ()
+        if after_seq is not None:
+            filters.append(f'{seq} > ?')
+            page_args += (after_seq,)
+        if before_seq is not None:
+            filters.append(f'{seq} < ?')
+            page_args += (before_seq,)
+        page_filter = 'WHERE ' + ' AND '.join(filters) if filters else ''
+        page = f'SELECT {seq} FROM forum_threads {page_filter} ORDER BY {seq} DESC LIMIT ? OFFSET ?'
+        page_args += (limit if limit is not None else self.no_limit, offset)
+
+        # Get the page of threads with current agent names
+        threads = self.execute(f'''
+            {self.thread_select}
+            WHERE t.{seq} IN ({page})
+            ORDER BY t.{seq} DESC
+        ''', page_args).fetchall()
+
+        # Get the replies for every thread on the page in one query
+        replies_by_thread = {thread['thread_id']: [] for thread in threads}
+        if threads:
+            replies = self.execute(f'''
+                {REPLY_SELECT}
+                WHERE r.thread_id IN (SELECT thread_id FROM forum_threads WHERE {seq} IN ({page}))
+                ORDER BY r.thread_id, r.timestamp, r.reply_id
+            ''', page_args).fetchall()
+            for reply in replies:
+                replies_by_thread[reply['thread_id']].append(reply)
+
+        return [thread_from_row(thread, replies_by_thread[thread['thread_id']]) for thread in threads]
+
+    def get_forum_thread(self, thread_id):
+        """Get a single thread with all its replies by primary key. Returns None if not found"""
+        thread = self.execute(f'{self.thread_select} WHERE t.thread_id = ?', (thread_id,)).fetchone()
+        if thread is None:
+            return None
+
+        replies = self.execute(f'{REPLY_SELECT} WHERE r.thread_id = ? ORDER BY r.timestamp, r.reply_id', (thread_id,)).fetchall()
+        return thread_from_row(thread, replies)
+
+    def get_recent_forum_threads(self, limit=30, replies_per_thread=2):
+        """
+        Get the limit most recent threads, each with only its replies_per_thread latest replies
+        (newest reply first). The per-thread reply cut is done in SQL with a window function.
+        """
+        seq = self.seq_column
+        page = f'SELECT {seq} FROM forum_threads ORDER BY {seq} DESC LIMIT ?'
+        threads = self.execute(f'''
+            {self.thread_select}
+            WHERE t.{seq} IN ({page})
+            ORDER BY t.{seq} DESC
+        ''', (limit,)).fetchall()
+
+        replies_by_thread = {thread['thread_id']: [] for thread in threads}
+        if threads:
+            replies = self.execute(f'''
+                SELECT reply_id, thread_id, author, content, timestamp, attachment FROM (
+                    SELECT ranked.*,
+                           ROW_NUMBER() OVER (PARTITION BY thread_id ORDER BY timestamp DESC, reply_id DESC) AS reply_rank
+                    FROM ({REPLY_SELECT} WHERE r.thread_id IN (SELECT thread_id FROM forum_threads WHERE {seq} IN ({page}))) ranked
+                ) numbered
+                WHERE reply_rank <= ?
+                ORDER BY thread_id, reply_rank
+            ''', (limit, replies_per_thread)).fetchall()
+            for reply in replies:
+                replies_by_thread[reply['thread_id']].append(reply)
+
+        return [thread_from_row(thread, replies_by_thread[thread['thread_id']]) for thread in threads]
+
+    def get_forum_replies_since(self, reply_id):
+        """Get every reply posted after reply_id, oldest first, with its thread_id"""
+        return self.execute(f'''
+            {REPLY_SELECT}
+            WHERE r.reply_id > ?
+            ORDER BY r.reply_id
+        ''', (reply_id,)).fetchall()
+
+    def save_forum_reply(self, thread_id, reply_data):
+        """Save a forum reply to the database"""
+        with self.transaction():
+            self.execute('''
+                INSERT INTO forum_replies (thread_id, author, content, timestamp, attachment)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                thread_id,
+                reply_data['author'],
+                reply_data['content'],
+                reply_data['timestamp'],
+                json.dumps(reply_data.get('attachment')) if reply_data.get('attachment') else None
+            ))
+
+    # Chat
+
+    def save_chat_message(self, message_data):
+        """Save a chat message to the database"""
+        with self.transaction():
+            self.execute('''
+                INSERT INTO chat_messages (sender, message, timestamp)
+                VALUES (?, ?, ?)
+            ''', (
+                message_data['sender'],
+                message_data['message'],
+                message_data['timestamp']
+            ))
+
+    def get_chat_messages(self, limit=None, before_id=None, after_id=None):
+        """
+        Get chat messages, always ordered oldest first by message_id.
+
+        With after_id, returns the first limit messages posted after it (reading forward).
+        Otherwise returns the limit most recent messages, or those just before before_id (paging back).
+        Without a limit every matching message is returned.
+
+        message_id is the table's primary key, so these keyset range scans walk
+        its index and never sort or scan the whole table.
+        """
+        if after_id is not None:
+            return self.execute(
+                f'{CHAT_SELECT} WHERE message_id > ? ORDER BY message_id LIMIT ?',
+                (after_id, limit if limit else self.no_limit)
+            ).fetchall()
+
+        # Take the newest matching messages, then flip them back to oldest first
+        before_filter = 'WHERE message_id < ?' if before_id is not None else ''
+        return self.execute(
+            f'''SELECT * FROM (
+                    {CHAT_SELECT} {before_filter} ORDER BY message_id DESC LIMIT ?
+                ) page ORDER BY message_id''',
+            ((before_id,) if before_id is not None else ()) + (limit if limit else self.no_limit,)
+        ).fetchall()
+
+    # Agents
+
+    def save_agent(self, agent_data, all_agents=None):
+        """Save or update an agent in the database"""
+        try:
+            # Commits on success, rolls back on error so the pooled connection is left clean
+            with self.transaction():
+                if all_agents is not None:
+                    # First delete the old agent entry
+                    self.execute('DELETE FROM agents WHERE agent_id = ?', (agent_data.get('id'),))
+
+                # Insert or update the agent
+                self.execute(f'''
+                    INSERT INTO agents
+                    (agent_id, name, persona, thoughts, activity, latest_activity, "left", joined_at, left_timestamp, version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, {self.next_version})
+                    ON CONFLICT (agent_id, name) DO UPDATE SET
+                        persona = excluded.persona, thoughts = excluded.thoughts, activity = excluded.activity,
+                        latest_activity = excluded.latest_activity, "left" = excluded."left",
+                        joined_at = excluded.joined_at, left_timestamp = excluded.left_timestamp,
+                        version = excluded.version
+                ''', (
+                    agent_data.get('id'),
+                    agent_data.get('name'),
+                    agent_data.get('persona'),
+                    json.dumps(agent_data.get('thoughts', [])),
+                    json.dumps(agent_data.get('activity', [])),
+                    agent_data.get('latestActivity'),
+                    agent_data.get('left', False),
+                    agent_data.get('joinedAt'),
+                    agent_data.get('leftTimestamp')
+                ))
+            return True
+        except Exception as e:
+            print(f"Error saving agent: {str(e)}")
+            return False
+
+    def get_agents(self, active_only=True):
+        """Get all agents, optionally filtering to only active ones"""
+        if active_only:
+            agents = self.execute(f'{AGENT_SELECT} WHERE NOT "left" ORDER BY latest_activity DESC').fetchall()
+        else:
+            agents = self.execute(f'{AGENT_SELECT} ORDER BY latest_activity DESC').fetchall()
+
+        return [agent_from_row(agent) for agent in agents]
+
+    def get_agents_since(self, version):
+        """Get every agent, active or not, whose row changed after version, oldest change first"""
+        agents = self.execute(f'{AGENT_SELECT} WHERE version > ? ORDER BY version', (version,)).fetchall()
+        return [agent_from_row(agent) for agent in agents]
+
+    def get_agent(self, agent_id, name=None):
+        """Get a single agent by id, and by name if given. Returns None if not found"""
+        if name is None:
+            agent = self.execute(f'{AGENT_SELECT} WHERE agent_id = ? LIMIT 1', (agent_id,)).fetchone()
+        else:
+            agent = self.execute(f'{AGENT_SELECT} WHERE agent_id = ? AND name = ?', (agent_id, name)).fetchone()
+
+        return agent_from_row(agent) if agent else None
+
+    def update_agent(self, agent_id, fields, name=None):
+        """Update only the given fields of one agent. Returns True if the agent was found"""
+        columns = []
+        values = []
+        for key, value in fields.items():
+            column = AGENT_COLUMNS[key]
+            columns.append(f'{column} = ?')
+            values.append(json.dumps(value) if column in AGENT_JSON_COLUMNS else value)
+
+        columns.append(f'version = {self.next_version}')
+        query = f'UPDATE agents SET {", ".join(columns)} WHERE agent_id = ?'
+        values.append(agent_id)
+        if name is not None:
+            query += ' AND name = ?'
+            values.append(name)
+
+        with self.transaction():
+            updated = self.execute(query, values).rowcount
+        return updated > 0
+
+    def append_agent_item(self, agent_id, name, field, item, max_items=5, latest_activity=None):
+        """Append to an agent's thoughts or activity list, keeping only the last max_items"""
+        column = AGENT_COLUMNS[field]
+        if column not in AGENT_JSON_COLUMNS:
+            raise ValueError(f"Cannot append to agent field {field}")
+
+        # Lock the row before reading so concurrent appends are not lost
+        with self.write_transaction():
+            row = self.execute(f'SELECT {column} FROM agents WHERE agent_id = ? AND name = ?{self.lock_rows}', (agent_id, name)).fetchone()
+            if row is None:
+                return False
+
+            items = json.loads(row[column]) if row[column] else []
+            items.append(item)
+            items = items[-max_items:]
+
+            if latest_activity is not None:
+                self.execute(f'UPDATE agents SET {column} = ?, latest_activity = ?, version = {self.next_version} WHERE agent_id = ? AND name = ?',
+                             (json.dumps(items), latest_activity, agent_id, name))
+            else:
+                self.execute(f'UPDATE agents SET {column} = ?, version = {self.next_version} WHERE agent_id = ? AND name = ?',
+                             (json.dumps(items), agent_id, name))
+        return True
+
+    def rename_agent(self, agent_id, name):
+        """Rename an agent, collapsing any other rows it has under old names"""
+        with self.transaction():
+            updated = self.rename_rows(agent_id, name)
+        return updated > 0
+
+    def apply_agent_changes(self, agent_id, name, changes, max_items=5):
+        """
+        Apply a batch of buffered changes to one agent in a single transaction.
+
+        changes may contain:
+            new_name        rename the agent first, the rest applies to the renamed row
+            clear_thoughts  drop existing thoughts before appending
+            thoughts        thoughts to append
+            clear_activity  drop existing activity before appending
+            activity        activities to append
+            persona         new persona
+            latestActivity  new latest activity timestamp
+        Thought and activity lists keep only the last max_items. Returns True if the agent was found.
+        """
+        with self.write_transaction():
+            if changes.get('new_name') is not None:
+                self.rename_rows(agent_id, changes['new_name'])
+                name = changes['new_name']
+
+            row = self.execute(f'SELECT thoughts, activity FROM agents WHERE agent_id = ? AND name = ?{self.lock_rows}', (agent_id, name)).fetchone()
+            if row is None:
+                return False
+
+            fields = {}
+            for field, clear_key in (('thoughts', 'clear_thoughts'), ('activity', 'clear_activity')):
+                if not changes.get(clear_key) and not changes.get(field):
+                    continue
+                items = [] if changes.get(clear_key) else (json.loads(row[field]) if row[field] else [])
+                items.extend(changes.get(field, []))
+                fields[field] = json.dumps(items[-max_items:])
+            if changes.get('persona') is not None:
+                fields['persona'] = changes['persona']
+            if changes.get('latestActivity') is not None:
+                fields['latest_activity'] = changes['latestActivity']
+
+            if fields:
+                assignments = ", ".join(f'{column} = ?' for column in fields)
+                self.execute(f'UPDATE agents SET {assignments}, version = {self.next_version} WHERE agent_id = ? AND name = ?',
+                             list(fields.values()) + [agent_id, name])
+        return True
+
+    # Change tracking
+
+    def get_data_cursor(self):
+        """
+        Get the latest chat message id, thread sequence, reply id and agent version.
+        Each is an index lookup, so this is cheap enough to check on every poll.
+        """
+        return self.execute(f'''
+            SELECT (SELECT COALESCE(MAX(message_id), 0) FROM chat_messages) AS chat,
+                   (SELECT COALESCE(MAX({self.seq_column}), 0) FROM forum_threads) AS thread,
+                   (SELECT COALESCE(MAX(reply_id), 0) FROM forum_replies) AS reply,
+                   (SELECT COALESCE(MAX(version), 0) FROM agents) AS agent
+        ''').fetchone()
+
+    def get_updates(self, since):
+        """
+        Get everything that changed after the since cursor (as returned by get_data_cursor),
+        along with the new cursor, all read from one consistent snapshot.
+        """
+        with self.read_snapshot():
+            cursor = self.get_data_cursor()
+            return {
+                "cursor": cursor,
+                "chat": self.get_chat_messages(after_id=since.get('chat', 0)) if cursor['chat'] > since.get('chat', 0) else [],
+                "threads": self.get_forum_threads(after_seq=since.get('thread', 0)) if cursor['thread'] > since.get('thread', 0) else [],
+                "replies": self.get_forum_replies_since(since.get('reply', 0)) if cursor['reply'] > since.get('reply', 0) else [],
+                "agents": self.get_agents_since(since.get('agent', 0)) if cursor['agent'] > since.get('agent', 0) else []
+            }
+
+
+class SQLiteStorage(Storage):
+    """
+    A single SQLite file. WAL lets readers run alongside one writer at a time, so every
+    process writing to the polis queues on the same file lock.
+    """
+    # forum_threads has a TEXT primary key, its rowid records insertion order
+    seq_column = 'rowid'
+    # Every write to an agent row stamps it with the next version, so clients can ask
+    # for the agents that changed since the last version they saw
+    next_version = '(SELECT COALESCE(MAX(version), 0) + 1 FROM agents)'
+    no_limit = -1
+
+    # How long a writer waits for another process's write lock before giving up (ms)
+    busy_timeout_ms = 5000
+    # Compiled statements kept per connection, every query in this module fits
+    statement_cache_size = 256
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connect(self):
+        """Open a new database connection with row factory and pragmas set"""
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, cached_statements=self.statement_cache_size)
+        conn.row_factory = dict_factory
+        # WAL lets readers (the web server) run alongside a writer (the orchestrator)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # NORMAL is durable across application crashes in WAL mode and skips an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+        return conn
+
+    def create_tables(self, conn):
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS forum_threads (
+                thread_id TEXT PRIMARY KEY,
+                op_author TEXT,
+                op_content TEXT,
+                op_timestamp TEXT,
+                op_attachment TEXT
+            )
+        ''')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS forum_replies (
+                reply_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                thread_id TEXT,
+                author TEXT,
+                content TEXT,
+                timestamp TEXT,
+                attachment TEXT,
+                FOREIGN KEY (thread_id) REFERENCES forum_threads(thread_id)
+            )
+        ''')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT,
+                message TEXT,
+                timestamp TEXT
+            )
+        ''')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT,
+                name TEXT,
+                persona TEXT,
+                thoughts TEXT,
+                activity TEXT,
+                latest_activity TEXT,
+                left BOOLEAN DEFAULT FALSE,
+                joined_at TEXT,
+                left_timestamp TEXT,
+                version INTEGER DEFAULT 0,
+                PRIMARY KEY (agent_id, name)
+            )
+        ''')
+
+        # Databases created before agents had a version column
+        columns = [row['name'] for row in c.execute('PRAGMA table_info(agents)').fetchall()]
+        if 'version' not in columns:
+            c.execute('ALTER TABLE agents ADD COLUMN version INTEGER DEFAULT 0')
+
+        # Replies are always fetched per thread in timestamp order, and forum authors
+        # are resolved to current agent names by agent_id
+        c.execute('CREATE INDEX IF NOT EXISTS idx_forum_replies_thread_timestamp ON forum_replies(thread_id, timestamp)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_agents_agent_id ON agents(agent_id)')
+        # Clients poll for agents changed since the last version they saw
+        c.execute('CREATE INDEX IF NOT EXISTS idx_agents_version ON agents(version)')
+
+    @contextmanager
+    def transaction(self):
+        conn = self.get_connection()
+        with conn:
+            yield conn
+
+    @contextmanager
+    def write_transaction(self):
+        conn = self.get_connection()
+        with conn:
+            # Take the write lock up front, SQLite has no row locks
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    @contextmanager
+    def read_snapshot(self):
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.commit()
+
+    def rename_rows(self, agent_id, name):
+        return self.execute(f'UPDATE OR REPLACE agents SET name = ?, version = {self.next_version} WHERE agent_id = ?', (name, agent_id)).rowcount
+
+
+class PostgresStorage(Storage):
+    """
+    A PostgreSQL database, for several orchestrator processes writing at once. Writers only
+    lock the agent rows they change, and agent versions come from a sequence so they never
+    contend on a MAX(version) read.
+
+    Ids and versions are handed out when a row is written, not when it commits, so a reader
+    can see a later id before an earlier one commits. The data cursor is therefore ordered by
+    commit instead: every row records the transaction that last wrote it (xid), and the cursor
+    is the oldest transaction still running when it was read. Everything older has committed,
+    so get_updates sends every row written at or after the client's cursor again and clients
+    skip the ones they already have. Needs PostgreSQL 13 or later.
+
+    Needs psycopg 3 (pip install "psycopg[binary]"). embedded() runs a private server
+    through pgserver, for local development and tests without installing PostgreSQL.
+    """
+    seq_column = 'seq'
+    next_version = "nextval('agent_version_seq')"
+    # LIMIT NULL is no limit in PostgreSQL
+    no_limit = None
+    lock_rows = ' FOR UPDATE'
+
+    # Arbitrary key for the advisory lock serializing schema creation across processes
+    schema_lock_key = 7607
+
+    def __init__(self, url):
+        try:
+            import psycopg
+            from psycopg.rows import dict_row
+        except ImportError:
+            raise ImportError('PostgreSQL storage needs psycopg, install it with pip install "psycopg[binary]"')
+        super().__init__()
+        self.url = url
+        self.psycopg = psycopg
+        self.dict_row = dict_row
+        self.server = None
+
+    @classmethod
+    def embedded(cls, data_dir):
+        """Start (or attach to) a PostgreSQL server kept in data_dir, using pgserver"""
+        try:
+            import pgserver
+        except ImportError:
+            raise ImportError('Embedded PostgreSQL needs pgserver, install it with pip install pgserver')
+        os.makedirs(data_dir, exist_ok=True)
+        server = pgserver.get_server(data_dir)
+        storage = cls(server.get_uri())
+        # Keep the server handle alive as long as the storage is in use
+        storage.server = server
+        return storage
+
+    def connect(self):
+        # Autocommit outside of explicit transactions, so reads do not hold a transaction open.
+        # Statements run more than a few times are prepared server side by psycopg
+        return self.psycopg.connect(self.url, autocommit=True, row_factory=self.dict_row)
+
+    def sql(self, query):
+        # psycopg uses %s placeholders, so literal percent signs have to be doubled
+        return query.replace('%', '%%').replace('?', '%s')
+
+    def create_tables(self, conn):
+        # Several processes may start at once, CREATE ... IF NOT EXISTS alone can race
+        self.execute('SELECT pg_advisory_xact_lock(?)', (self.schema_lock_key,))
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS forum_threads (
+                seq BIGSERIAL UNIQUE,
+                thread_id TEXT PRIMARY KEY,
+                op_author TEXT,
+                op_content TEXT,
+                op_timestamp TEXT,
+                op_attachment TEXT
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS forum_replies (
+                reply_id BIGSERIAL PRIMARY KEY,
+                thread_id TEXT REFERENCES forum_threads(thread_id),
+                author TEXT,
+                content TEXT,
+                timestamp TEXT,
+                attachment TEXT
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                message_id BIGSERIAL PRIMARY KEY,
+                sender TEXT,
+                message TEXT,
+                timestamp TEXT
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT,
+                name TEXT,
+                persona TEXT,
+                thoughts TEXT,
+                activity TEXT,
+                latest_activity TEXT,
+                "left" BOOLEAN DEFAULT FALSE,
+                joined_at TEXT,
+                left_timestamp TEXT,
+                version BIGINT DEFAULT 0,
+                PRIMARY KEY (agent_id, name)
+            )
+        ''')
+        conn.execute('CREATE SEQUENCE IF NOT EXISTS agent_version_seq')
+
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_forum_replies_thread_timestamp ON forum_replies(thread_id, timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_agents_agent_id ON agents(agent_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_agents_version ON agents(version)')
+
+        # The transaction that last wrote each row, for the commit-ordered data cursor
+        conn.execute('''
+            CREATE OR REPLACE FUNCTION polis_set_xid() RETURNS trigger AS $$
+            BEGIN
+                NEW.xid := pg_current_xact_id();
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        for table in ['chat_messages', 'forum_threads', 'forum_replies', 'agents']:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS xid xid8')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_xid ON {table}(xid)')
+            conn.execute(f'DROP TRIGGER IF EXISTS {table}_xid ON {table}')
+            conn.execute(f'CREATE TRIGGER {table}_xid BEFORE INSERT OR UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION polis_set_xid()')
+
+    @contextmanager
+    def transaction(self):
+        conn = self.get_connection()
+        with conn.transaction():
+            yield conn
+
+    @contextmanager
+    def write_transaction(self):
+        # Rows read with lock_rows stay locked until commit
+        with self.transaction() as conn:
+            yield conn
+
+    @contextmanager
+    def read_snapshot(self):
+        conn = self.get_connection()
+        if conn.info.transaction_status != self.psycopg.pq.TransactionStatus.IDLE:
+            yield conn
+            return
+
+        with conn.transaction():
+            conn.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            yield conn
+
+    def get_data_cursor(self):
+        """
+        The oldest transaction still running, for every part of the cursor. It only moves
+        once every transaction before it has committed or rolled back.
+        """
+        horizon = self.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS horizon').fetchone()['horizon']
+        return {'chat': horizon, 'thread': horizon, 'reply': horizon, 'agent': horizon}
+
+    def get_updates(self, since):
+        with self.read_snapshot():
+            cursor = self.get_data_cursor()
+            # The first id of each kind written at or after the client's cursor. Rows from
+            # there on are sent again, which covers rows whose transaction was still running
+            first = self.execute(f'''
+                SELECT (SELECT MIN(message_id) FROM chat_messages WHERE xid >= ?::text::xid8) AS chat,
+                       (SELECT MIN(seq) FROM forum_threads WHERE xid >= ?::text::xid8) AS thread,
+                       (SELECT MIN(reply_id) FROM forum_replies WHERE xid >= ?::text::xid8) AS reply,
+                       (SELECT MIN(version) FROM agents WHERE xid >= ?::text::xid8) AS agent
+            ''', tuple(str(since.get(key, 0)) for key in ['chat', 'thread', 'reply', 'agent'])).fetchone()
+            return {
+                "cursor": cursor,
+                "chat": self.get_chat_messages(after_id=first['chat'] - 1) if first['chat'] is not None else [],
+                "threads": self.get_forum_threads(after_seq=first['thread'] - 1) if first['thread'] is not None else [],
+                "replies": self.get_forum_replies_since(first['reply'] - 1) if first['reply'] is not None else [],
+                "agents": self.get_agents_since(first['agent'] - 1) if first['agent'] is not None else []
+            }
+
+    def rename_rows(self, agent_id, name):
+        # Keep only the agent's most recently written row, then rename it
+        self.execute('''
+            DELETE FROM agents WHERE agent_id = ? AND ctid <> (
+                SELECT ctid FROM agents WHERE agent_id = ? ORDER BY version DESC LIMIT 1
+            )
+        ''', (agent_id, agent_id))
+        return self.execute(f'UPDATE agents SET name = ?, version = {self.next_version} WHERE agent_id = ?', (name, agent_id)).rowcount
+
+
+def open_storage(url, default_path):
+    """
+    Open the storage backend for a database URL:
+        (empty)                  the SQLite file at default_path
+        sqlite:///abs/path/to/file      a SQLite file
+        postgresql://...                a PostgreSQL server
+        pgserver:///abs/path/to/dir     an embedded PostgreSQL server kept in that directory
+    """
+    if not url:
+        return SQLiteStorage(default_path)
+    if url.startswith('sqlite://'):
+        return SQLiteStorage(url[len('sqlite://'):])
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresStorage(url)
+    if url.startswith('pgserver://'):
+        return PostgresStorage.embedded(url[len('pgserver://'):])
+    raise ValueError(f"Unsupported database URL: {url}")
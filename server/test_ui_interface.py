@@ -124,9 +124,10 @@ def main():
         posts = research_ui.get_forum_posts()
         print(f"Number of forum posts: {len(posts)}")
         
-        # Test getting specific post
-        if posts:
-            thread_id = posts[0]['threadId']
+        # Test getting specific post, the one with the image attachment (posts are newest first)
+        image_posts = [post for post in posts if post['op'].get('attachment', {}).get('name', '').endswith('.png')]
+        if image_posts:
+            thread_id = image_posts[0]['threadId']
             print("\nTesting get_forum_post...")
             post = research_ui.get_forum_post(thread_id)
             print(f"Retrieved post has attachment: {'attachment' in post['op']}")
@@ -210,6 +211,14 @@ def main():
         code_review_ui.add_thought("Should suggest performance optimizations")
         code_review_ui.add_activity("Started code review process")
         code_review_ui.add_activity("Analyzing performance bottlenecks")
+
+        # Test buffering a pass's agent changes and writing them in one transaction
+        print("\nTesting batched pass updates for CodeReviewAgent...")
+        with code_review_ui.batch_pass():
+            code_review_ui.add_activity("Reviewed a pull request")
+            code_review_ui.add_thought("Batched updates keep the database quiet")
+            code_review_ui.update_persona("I review and optimize code")
+        print(f"Batched changes flushed: {code_review_ui.pending_changes is None}")
         
         # Add more chat messages
         code_review_ui.post_to_chat("Hello, I'm here to help with code review")
@@ -3,13 +3,15 @@ import json
 import os
 import uuid
 import hashlib
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
 import shutil
 
 # Import database functions
 from database import (
-    get_forum_threads, get_chat_messages, get_agents, save_forum_thread,
-    save_forum_reply, save_chat_message, save_agent, get_agents
+    get_forum_thread, get_recent_forum_threads, get_chat_messages, get_agents, save_forum_thread,
+    save_forum_reply, save_chat_message, save_agent, get_agent, update_agent,
+    append_agent_item, rename_agent, apply_agent_changes
 )
 
 # File paths for persistent storage
@@ -60,14 +62,61 @@ class UIInterface:
         self.private_key = private_key
         # Generate agent_id from private key
         self.agent_id = hashlib.sha256(private_key.encode()).hexdigest() if private_key else None
-        
-        # Get active agents from database
-        self.agents = get_agents(active_only=True)
+
+        # Agent row changes buffered between begin_pass and flush_pass, None when not batching
+        self.pending_changes = None
         
         # Only log initialization when we have actual agent credentials
         if name and private_key:
             print(f"Initialized UI Interface for agent {name} with ID {self.agent_id}")
 
+    @property
+    def agents(self) -> list:
+        """Active agents, read from the database on access"""
+        return get_agents(active_only=True)
+
+    def begin_pass(self):
+        """
+        Start buffering thought, activity, persona and name changes for this agent.
+        They are written together in a single transaction by flush_pass.
+        """
+        if self.pending_changes is None:
+            self.pending_changes = {}
+
+    def flush_pass(self) -> bool:
+        """Write the buffered changes in a single transaction and stop buffering."""
+        changes = self.pending_changes
+        self.pending_changes = None
+        if not changes:
+            return True
+        
+        try:
+            return apply_agent_changes(self.agent_id, self.agent_name, changes)
+        except Exception as e:
+            print(f"Error in flush_pass: {str(e)}")
+            return False
+
+    @contextmanager
+    def batch_pass(self):
+        """Buffer agent row changes for the duration of the block, then flush them."""
+        self.begin_pass()
+        try:
+            yield self
+        finally:
+            self.flush_pass()
+
+    def sync_pending(self):
+        """Flush buffered changes before reading or writing the agent row directly, and keep buffering."""
+        if self.pending_changes:
+            self.flush_pass()
+            self.begin_pass()
+
+    def is_active(self, match_name: bool = True) -> bool:
+        """Check this agent's own row, optionally requiring its current name to match"""
+        self.sync_pending()
+        agent = get_agent(self.agent_id, self.agent_name if match_name else None)
+        return agent is not None and not agent.get('left', False)
+
     def get_function_schemas(self):
         """Returns list of function schemas without requiring agent credentials"""
         return [{
@@ -115,9 +164,14 @@ class UIInterface:
                 "limit": {
                     "type": "integer",
                     "description": "The number of messages to return (required)"
+                },
+                "before_id": {
+                    "type": "integer",
+                    "description": "Only return messages older than this message_id, to page back through history (optional)",
+                    "optional": True
                 }
             },
-            "description": "Get the chat history, optionally limited to N most recent messages."
+            "description": "Get the N most recent chat messages, oldest first. Use the message_id of the oldest message as before_id to read further back."
         },{
             "name": "post_reply",
             "arguments": {
@@ -140,26 +194,17 @@ class UIInterface:
             return False
         
         self.has_joined = True
+        self.sync_pending()
         default_persona = f"You are {self.agent_name}. An advanced agent that can perform a variety of tasks."
         persona = persona if persona else default_persona
         
         try:
-            # Check if agent is already active
-            active_agents = get_agents(active_only=True)
-            if any(agent.get('id') == self.agent_id for agent in active_agents):
+            # Check if agent exists in history, and whether it is already active
+            existing_agent = get_agent(self.agent_id)
+            if existing_agent and not existing_agent.get('left', False):
                 print(f"Agent {self.agent_name} ({self.agent_id}) already active")
                 return True
             
-            # Get all agents including inactive ones
-            all_agents = get_agents(active_only=False)
-            
-            # Check if agent exists in history
-            existing_agent = None
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id:
-                    existing_agent = agent
-                    break
-            
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
             # Create new agent data
@@ -177,8 +222,6 @@ class UIInterface:
             # Save to database
             save_agent(new_agent)
             
-            # Update local agents list
-            self.agents = get_agents(active_only=True)
             print(f"Agent {self.agent_name} ({self.agent_id}) joined successfully")
             return True
             
@@ -193,21 +236,14 @@ class UIInterface:
             return False
             
         self.has_joined = False
+        self.sync_pending()
 
         try:
-            # Get all agents including inactive ones
-            all_agents = get_agents(active_only=False)
-            
-            # Find and update the agent
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    agent['left'] = True
-                    agent['leftTimestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    save_agent(agent)
-                    break
-            
-            # Update local agents list
-            self.agents = get_agents(active_only=True)
+            update_agent(self.agent_id, {
+                'left': True,
+                'leftTimestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }, name=self.agent_name)
+            
             print(f"Agent {self.agent_name} left")
             return True
         except Exception as e:
@@ -222,11 +258,8 @@ class UIInterface:
         
         try:
             # Verify agent is active
-            active_agents = get_agents(active_only=True)
-            is_active = any(agent.get('id') == self.agent_id for agent in active_agents)
-            if not is_active:
+            if not self.is_active(match_name=False):
                 print(f"Agent {self.agent_name} ({self.agent_id}) not active")
-                print("Active agents:", [(a.get('name'), a.get('id')) for a in active_agents])
                 return False
             
             thread_data = {
@@ -288,17 +321,8 @@ class UIInterface:
     def get_forum_posts(self) -> list:
         """Get the 30 most recent forum posts with up to 2 latest replies each."""
         try:
-            threads = get_forum_threads()  # Already sorted by most recent activity
-            recent_threads = threads[:30]
-            
-            # For each thread, limit replies to 2 most recent
-            for thread in recent_threads:
-                if thread['replies']:
-                    thread['replies'] = sorted(
-                        thread['replies'],
-                        key=lambda x: x['timestamp'],
-                        reverse=True
-                    )[:2]
+            # Newest threads first, each with its 2 most recent replies
+            recent_threads = get_recent_forum_threads(limit=30, replies_per_thread=2)
             
             # limit posts and reply text to the first 300 characters, whithout editing the original text, and add ... if the text is longer
             for thread in recent_threads:
@@ -314,19 +338,15 @@ class UIInterface:
     def get_forum_post(self, thread_id: str) -> dict:
         """Get a specific forum post by ID with all its replies."""
         try:
-            threads = get_forum_threads()
-            for thread in threads:
-                if thread['threadId'] == thread_id:
-                    return thread
-            return None
+            return get_forum_thread(thread_id)
         except Exception as e:
             print(f"Error in get_forum_post: {str(e)}")
             return None
 
-    def get_chat_history(self, limit: int = None) -> list:
-        """Get chat messages, optionally limited to N most recent messages."""
+    def get_chat_history(self, limit: int = None, before_id: int = None) -> list:
+        """Get chat messages oldest first, optionally limited to the N most recent before before_id."""
         try:
-            return get_chat_messages(limit)
+            return get_chat_messages(limit, before_id=before_id)
         except Exception as e:
             print(f"Error in get_chat_history: {str(e)}")
             return []
@@ -356,19 +376,13 @@ class UIInterface:
             print("No agent credentials provided")
             return False
             
+        if self.pending_changes is not None:
+            self.pending_changes.setdefault('thoughts', []).append(thought)
+            return True
+            
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    thoughts = agent.get('thoughts', [])
-                    thoughts.append(thought)
-                    if len(thoughts) > 5:  # Keep only last 5 thoughts
-                        thoughts.pop(0)
-                    agent['thoughts'] = thoughts
-                    save_agent(agent)
-                    return True
-            return False
+            # Keep only last 5 thoughts
+            return append_agent_item(self.agent_id, self.agent_name, 'thoughts', thought, max_items=5)
         except Exception as e:
             print(f"Error in add_thought: {str(e)}")
             return False
@@ -379,20 +393,15 @@ class UIInterface:
             print("No agent credentials provided")
             return False
             
+        if self.pending_changes is not None:
+            self.pending_changes.setdefault('activity', []).append(activity)
+            self.pending_changes['latestActivity'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return True
+            
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    activities = agent.get('activity', [])
-                    activities.append(activity)
-                    if len(activities) > 5:  # Keep only last 5 activities
-                        activities.pop(0)
-                    agent['activity'] = activities
-                    agent['latestActivity'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    save_agent(agent)
-                    return True
-            return False
+            # Keep only last 5 activities
+            return append_agent_item(self.agent_id, self.agent_name, 'activity', activity, max_items=5,
+                                     latest_activity=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         except Exception as e:
             print(f"Error in add_activity: {str(e)}")
             return False
@@ -405,8 +414,7 @@ class UIInterface:
             
         try:
             # Verify agent is active
-            if not any(agent.get('id') == self.agent_id and agent['name'] == self.agent_name
-                      and not agent.get('left', False) for agent in self.agents):
+            if not self.is_active():
                 print(f"Agent {self.agent_name} not active")
                 return False
             
@@ -434,8 +442,7 @@ class UIInterface:
             
         try:
             # Verify agent is active
-            if not any(agent.get('id') == self.agent_id and agent['name'] == self.agent_name
-                      and not agent.get('left', False) for agent in self.agents):
+            if not self.is_active():
                 print(f"Agent {self.agent_name} not active")
                 return False
             
@@ -530,15 +537,13 @@ class UIInterface:
             print("No agent credentials provided")
             return False
         
+        if self.pending_changes is not None:
+            self.pending_changes['clear_thoughts'] = True
+            self.pending_changes['thoughts'] = []
+            return True
+        
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    agent['thoughts'] = []
-                    save_agent(agent)
-                    return True
-            return False
+            return update_agent(self.agent_id, {'thoughts': []}, name=self.agent_name)
         except Exception as e:
             print(f"Error in clear_thoughts: {str(e)}")
             return False
@@ -549,15 +554,13 @@ class UIInterface:
             print("No agent credentials provided")
             return False
         
+        if self.pending_changes is not None:
+            self.pending_changes['clear_activity'] = True
+            self.pending_changes['activity'] = []
+            return True
+        
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    agent['activity'] = []
-                    save_agent(agent)
-                    return True
-            return False
+            return update_agent(self.agent_id, {'activity': []}, name=self.agent_name)
         except Exception as e:
             print(f"Error in clear_activity: {str(e)}")
             return False 
@@ -568,19 +571,17 @@ class UIInterface:
             print("No agent credentials provided")
             return False
         
+        if self.pending_changes is not None:
+            self.pending_changes['new_name'] = name
+            self.agent_name = name
+            return True
+        
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id:
-                    # Update the name
-                    agent['name'] = name
-                    # Update the instance variable
-                    self.agent_name = name
-                    # Save the updated agent
-                    save_agent(agent, all_agents)
-                    return True
-            return False
+            if not rename_agent(self.agent_id, name):
+                return False
+            # Update the instance variable
+            self.agent_name = name
+            return True
         except Exception as e:
             print(f"Error in update_name: {str(e)}")
             return False
@@ -591,15 +592,12 @@ class UIInterface:
             print("No agent credentials provided")
             return False
             
+        if self.pending_changes is not None:
+            self.pending_changes['persona'] = persona
+            return True
+            
         try:
-            # Get current agent data
-            all_agents = get_agents(active_only=False)
-            for agent in all_agents:
-                if agent.get('id') == self.agent_id and agent['name'] == self.agent_name:
-                    agent['persona'] = persona
-                    save_agent(agent)
-                    return True
-            return False
+            return update_agent(self.agent_id, {'persona': persona}, name=self.agent_name)
         except Exception as e:
             print(f"Error in update_persona: {str(e)}")
             return False